@@ -2,26 +2,98 @@
 Manage password hashing, authentication, and oAuth2 compliant JOSE/JWT access tokens.
 To remain oAuth2 compliant "username" field must be used for the log in.
 JWT tokens pack expiry datetime and email ("username") as the subject ("sub") field.
+With JWT_CLAIMS set, tokens also pack the user uuid, name, active flag and token generation,
+so requests are authorised from the claims alone without looking up the user.
+Revoking a user's tokens increments their generation, denying tokens of earlier generations
+once each worker refreshes its copy of revocations.
+Verified tokens are cached by digest until they expire, so clients reusing a token skip signature verification.
+Tokens are signed and verified by python-jose, or PyJWT with JWT_BACKEND set to "pyjwt".
 Future use could include packing scopes for authorisation.
 JWT settings such as the signature for signing the tokens are taken from the environment.
 """
+import time
+import asyncio
+import hashlib
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import bcrypt  # https://pypi.org/project/bcrypt/
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
-from models import JWTSettings, User, TokenData
-from db import get_user, save_user
+import metrics
+from cache import LRUCache
+from models import JWTSettings, BcryptSettings, CacheSettings, User, UserRec, TokenData
+from storage import get_user, get_cached_user, save_user, token_generation, revoked_generations
 
 
 jwt_settings = JWTSettings()
 JWT_SIGNATURE = jwt_settings.jwt_signature
 JWT_ALGORITHM = jwt_settings.jwt_algorithm
 JWT_EXPIRE_MINUTES = jwt_settings.jwt_expire_minutes
+JWT_CLAIMS = jwt_settings.jwt_claims
+
+
+class JoseBackend:
+    """Sign and verify tokens with python-jose."""
+
+    def encode(self, claims: dict):
+        return jwt.encode(claims, JWT_SIGNATURE, algorithm=JWT_ALGORITHM)
+
+    def decode(self, token: str):
+        """Return verified claims, raising JWTError if the token is invalid or expired."""
+        return jwt.decode(token, JWT_SIGNATURE, algorithms=[JWT_ALGORITHM])
+
+
+class PyJWTBackend:
+    """Sign and verify tokens with PyJWT, which is faster, raising the same errors as python-jose."""
+
+    def __init__(self):
+        import jwt as pyjwt  # https://pypi.org/project/PyJWT/
+        self.pyjwt = pyjwt
+
+    def encode(self, claims: dict):
+        return self.pyjwt.encode(claims, JWT_SIGNATURE, algorithm=JWT_ALGORITHM)
+
+    def decode(self, token: str):
+        """Return verified claims, raising JWTError if the token is invalid or expired."""
+        try:
+            return self.pyjwt.decode(token, JWT_SIGNATURE, algorithms=[JWT_ALGORITHM])
+        except self.pyjwt.PyJWTError as error:
+            raise JWTError(str(error))
+
+
+class PendingLimit:
+    """Count of operations in flight, refusing more than limit. Checking and counting never wait, so never race."""
+
+    def __init__(self, limit: int):
+        self.limit, self.count = limit, 0
+
+    def acquire(self):
+        """Count another operation and return True, or return False if limit operations are in flight."""
+        if self.count >= self.limit:
+            return False
+        self.count += 1
+        return True
+
+    def release(self):
+        self.count -= 1
+
+
+jwt_backend = jwt_settings.jwt_backend == "pyjwt" and PyJWTBackend() or JoseBackend()
+cache_settings = CacheSettings()
+token_cache = LRUCache("token", cache_settings.token_cache_size)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+bcrypt_settings = BcryptSettings()
+if bcrypt_settings.bcrypt_executor == "process":
+    bcrypt_executor = ProcessPoolExecutor(max_workers=bcrypt_settings.bcrypt_workers)
+else:
+    bcrypt_executor = ThreadPoolExecutor(max_workers=bcrypt_settings.bcrypt_workers, thread_name_prefix="bcrypt")
+
+bcrypt_pending = PendingLimit(bcrypt_settings.bcrypt_pending)
+
 
 def password_hash(plain_password: str) -> str:
     """Generate and return salted Blowfish password hash."""
@@ -34,10 +106,28 @@ def password_check(plain_password: str, hashed_password: str):
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 
-def authenticate_user(username: str, password: str):
+async def run_bcrypt(function, *args):
+    """
+    Run bcrypt function in the bounded executor to keep CPU bound hashing off the event loop.
+    Raise 503 with Retry-After when too many hashing operations are already pending.
+    """
+    if not bcrypt_pending.acquire():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Authentication busy, try again shortly",
+            headers={"Retry-After": str(bcrypt_settings.bcrypt_retry_after)},
+        )
+    try:
+        with metrics.timed("bcrypt"):
+            return await asyncio.get_running_loop().run_in_executor(bcrypt_executor, function, *args)
+    finally:
+        bcrypt_pending.release()
+
+
+async def authenticate_user(username: str, password: str):
     """Return UserRec object for provided username (email) iff provided plain password matches."""
-    user = get_user(username)
-    if user and password_check(password, user.hashed):
+    user = await get_user(username)
+    if user and await run_bcrypt(password_check, password, user.hashed):
         return user
     return False
 
@@ -50,27 +140,66 @@ def create_access_token(data: dict):
     expiry = datetime.utcnow() + timedelta(minutes=JWT_EXPIRE_MINUTES)
     data = data.copy()  # {"sub": "<username>"} username expected to be email
     data.update({"exp": expiry})
-    encoded_jwt_access_token = jwt.encode(data, JWT_SIGNATURE, algorithm=JWT_ALGORITHM)
+    with metrics.timed("jwt"):
+        encoded_jwt_access_token = jwt_backend.encode(data)
     return encoded_jwt_access_token
 
 
-def create_new_user(user: dict):
+def decode_access_token(token: str):
+    """
+    Return verified claims of access token, raising JWTError if invalid or expired.
+    Claims are cached by token digest until the token expires, so a token is verified once per worker
+    while it stays in the cache. The digest covers the signature, so altered tokens are always verified.
+    """
+    key = hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+    payload = token_cache.get(key)
+    if payload is None:
+        with metrics.timed("jwt"):
+            payload = jwt_backend.decode(token)
+        ttl = payload.get("exp", 0) - time.time()
+        if ttl > 0:
+            token_cache.set(key, payload, ttl)
+    return payload
+
+
+async def create_user_access_token(user: UserRec):
+    """Return access token for authenticated user, packing user claims if enabled."""
+    data = {"sub": user.email}
+    if JWT_CLAIMS:
+        data.update(uid=user.uuid, name=user.name, active=user.active, gen=await token_generation(user.uuid))
+    return create_access_token(data=data)
+
+
+async def user_from_claims(payload: dict):
+    """Return User from token claims, or None if the token has been revoked."""
+    generations = await revoked_generations()
+    if payload.get("gen", 0) < generations.get(payload["uid"], 0):
+        return None
+    return User(uuid=payload["uid"], email=payload["sub"], active=payload.get("active", 0),
+                name=payload.get("name", ""))
+
+
+async def create_new_user(user: dict):
     """Create new User."""
-    if get_user(user["email"]):
+    if await get_user(user["email"]):
         return None
-    user["hashed"] = password_hash(user["plain"])
-    user = save_user(user)
+    user["hashed"] = await run_bcrypt(password_hash, user["plain"])
+    user = await save_user(user)
     return user
 
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     """Return currently authenticated user (without active check) or raise 401 unauthorized."""
     try:
-        payload = jwt.decode(token, JWT_SIGNATURE, algorithms=[JWT_ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")
-        if username:
+        if username and JWT_CLAIMS and "uid" in payload:
+            user = await user_from_claims(payload)
+            if user:
+                return user
+        elif username:
             token_data = TokenData(username=username)
-            user = get_user(username=token_data.username)
+            user = await get_cached_user(token_data.username)
             if user:
                 return user
     except JWTError:
@@ -0,0 +1,572 @@
+"""
+Benchmarks for a single worker, against the Redis configured in the environment or an in-memory fakeredis.
+
+The http benchmark drives the ASGI app in-process with concurrent clients and reports requests per second.
+It seeds a fresh user, questions and a published quiz through the API, then times a mix of authenticated reads.
+Only the API is used, so it can be run on two revisions against the same Redis to compare them::
+
+    python bench.py http --requests 5000 --concurrency 64
+    python bench.py http --fake  # In-memory fakeredis stand-in instead of the Redis configured in the environment
+    python bench.py http --fake --latency 1  # Add 1 ms per Redis round trip to stand in for the network
+
+The load benchmark seeds owners with questions and published quizzes, and users, through the API,
+then runs login, CRUD, solution submission and listing mixes in turn, reporting latency and throughput by endpoint.
+Save a baseline, then compare later runs against it, failing with exit status 1 on regression::
+
+    python bench.py load --fake --save-baseline baseline.json
+    python bench.py load --fake --baseline baseline.json --tolerance 0.2
+
+Use ``--backend memory`` for the in-process storage backend instead of Redis, e.g. comparing it with a Redis baseline::
+
+    python bench.py load --backend memory --baseline baseline.json
+
+The quizsave benchmark times creating, updating and publishing quizzes by number of questions::
+
+    python bench.py quizsave --fake --latency 1
+
+The scoring benchmark compares scoring solutions one at a time with batch scoring, without Redis::
+
+    python bench.py scoring --solutions 50000
+
+The jwt benchmark compares token verification per second with each JOSE backend, and with verified tokens cached::
+
+    python bench.py jwt --tokens 20000
+
+The codec benchmark compares stored record size and encode and decode times of each record codec, without Redis::
+
+    python bench.py codec --records 10000
+
+The responses benchmark compares building the response of an individual record through its response model
+with sending the stored record directly, as the read endpoints do, by codec and without Redis.
+The read mix of the load benchmark times those endpoints through the app::
+
+    python bench.py responses --records 10000
+    python bench.py load --fake --mixes read
+
+Requires httpx, msgpack and orjson, plus fakeredis for --fake.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import random
+import statistics
+import shortuuid
+
+
+def delayed(function, latency: float):
+    """Return function wrapped to sleep for latency seconds first, as a simulated network round trip."""
+    if asyncio.iscoroutinefunction(function):
+        async def delayed_function(*args, **kwargs):
+            await asyncio.sleep(latency)
+            return await function(*args, **kwargs)
+    else:
+        def delayed_function(*args, **kwargs):
+            time.sleep(latency)  # Blocks the event loop exactly as a synchronous client waiting on the network
+            return function(*args, **kwargs)
+    return delayed_function
+
+
+def delay(redis, latency: float):
+    """Delay each Redis command, and each pipeline as a single round trip, by latency seconds."""
+    redis.execute_command = delayed(redis.execute_command, latency)
+    pipeline = redis.pipeline
+
+    def delayed_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        pipe.execute = delayed(pipe.execute, latency)
+        return pipe
+    redis.pipeline = delayed_pipeline
+
+
+def setup(fake: bool, latency: float = 0, backend: str = "redis"):
+    """
+    Import the app with the given storage backend, substituting fakeredis with optional simulated latency
+    for the configured Redis if requested.
+    """
+    os.environ["STORAGE_BACKEND"] = backend
+    if fake or backend == "memory":
+        os.environ.setdefault("JWT_SIGNATURE", "bench")
+    if fake:
+        for name, value in (("REDIS_HOST", "localhost"), ("REDIS_PORT", "6379"), ("REDIS_PASSWORD", "")):
+            os.environ.setdefault(name, value)
+    from main import app
+    if fake and backend == "redis":
+        import db
+        import fakeredis
+        import fakeredis.aioredis
+        asynchronous = asyncio.iscoroutinefunction(db.get_user)
+        db.redis = asynchronous and fakeredis.aioredis.FakeRedis() or fakeredis.FakeRedis()
+        if hasattr(db, "InstrumentedRedis"):  # Keep counting Redis commands for metrics
+            db.redis = db.InstrumentedRedis(connection_pool=db.redis.connection_pool)
+        if latency:
+            delay(db.redis, latency)
+    return app
+
+
+async def login(client, email: str):
+    """Register user with given email and return authorisation headers."""
+    await client.post("/api/v1/users", json={"email": email, "name": "Bench", "plain": "secret"})
+    response = await client.post("/token", data={"username": email, "password": "secret"})
+    return {"Authorization": "Bearer " + response.json()["access_token"]}
+
+
+async def seed(client, questions: int):
+    """Create owner with questions and a published quiz, returning headers and read paths to exercise."""
+    owner = await login(client, "bench-{}@example.com".format(shortuuid.uuid()).lower())
+    uuids = []
+    for number in range(questions):
+        question = {"text": "Question {}".format(number), "answers": ["Yes", "No"], "correct": [True, False]}
+        response = await client.post("/api/v1/questions", json=question, headers=owner)
+        uuids.append(response.json()["uuid"])
+    response = await client.post("/api/v1/quizzes", json={"title": "Bench", "questions": uuids[:10]}, headers=owner)
+    quiz = response.json()["uuid"]
+    await client.put("/api/v1/quizzes/" + quiz, json={"published": True}, headers=owner)
+    paths = [
+        "/api/v1/users/me",
+        "/api/v1/questions/" + uuids[0],
+        "/api/v1/quizzes/" + quiz,
+        "/api/v1/questions",
+        "/api/v1/quizzes",
+    ]
+    return owner, paths
+
+
+async def drive(client, headers: dict, paths: list, requests: int, concurrency: int):
+    """Issue requests cycling through paths from concurrent clients, returning elapsed time and latencies by path."""
+    latencies = dict((path, []) for path in paths)
+    counter = iter(range(requests))
+
+    async def worker():
+        for number in counter:
+            path = paths[number % len(paths)]
+            start = time.perf_counter()
+            response = await client.get(path, headers=headers)
+            latencies[path].append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError("{} returned {}".format(path, response.status_code))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+
+def percentile(values: list, fraction: float):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def bench_http(args):
+    import httpx
+    app = setup(args.fake, args.latency / 1000, args.backend)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        headers, paths = await seed(client, args.questions)
+        await drive(client, headers, paths, min(args.requests, 200), args.concurrency)  # Warm up
+        elapsed, latencies = await drive(client, headers, paths, args.requests, args.concurrency)
+    rate = args.requests / elapsed
+    print("{:.0f} requests/sec ({} requests, concurrency {})".format(rate, args.requests, args.concurrency))
+    for path, values in latencies.items():
+        print("{:<60} p50 {:7.2f} ms  p99 {:7.2f} ms  mean {:7.2f} ms".format(
+            path[:60], percentile(values, 0.5) * 1000, percentile(values, 0.99) * 1000,
+            statistics.mean(values) * 1000))
+
+
+def report(latencies: dict, elapsed: float):
+    """Print and return latency percentiles and throughput by endpoint."""
+    endpoints = {}
+    for label, values in sorted(latencies.items()):
+        endpoints[label] = {
+            "p50": percentile(values, 0.5) * 1000,
+            "p99": percentile(values, 0.99) * 1000,
+            "rps": len(values) / elapsed,
+        }
+        print("  {:<44} p50 {:7.2f} ms  p99 {:7.2f} ms  {:8.0f} requests/sec".format(
+            label, endpoints[label]["p50"], endpoints[label]["p99"], endpoints[label]["rps"]))
+    return endpoints
+
+
+async def timed_request(client, latencies: dict, label: str, method: str, url: str, **kwargs):
+    """Issue request, recording its latency under endpoint label, and return the response, raising on failure."""
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    latencies.setdefault(label, []).append(time.perf_counter() - start)
+    if response.status_code >= 400:
+        raise RuntimeError("{} {} returned {}: {}".format(method, url, response.status_code, response.text))
+    return response
+
+
+async def seed_load(client, rng: random.Random, owners: int, users: int, questions: int, quizzes: int):
+    """Register owners with questions and published quizzes, and users to take them, returning the seeded state."""
+    run = shortuuid.uuid().lower()
+
+    async def register(role: str, number: int):
+        email = "bench-{}-{}-{}@example.com".format(role, number, run)
+        return email, await login(client, email)
+
+    state = {
+        "owners": await asyncio.gather(*(register("owner", number) for number in range(owners))),
+        "users": await asyncio.gather(*(register("user", number) for number in range(users))),
+        "quizzes": [],  # (owner headers, quiz uuid, number of questions)
+        "questions": [],  # (owner headers, question uuid)
+        "solutions": [],  # (user headers, solution uuid)
+    }
+    for _, owner in state["owners"]:
+        uuids = []
+        for number in range(questions):
+            question = {"text": "Question {}".format(number), "answers": ["Yes", "No"], "correct": [True, False]}
+            response = await client.post("/api/v1/questions", json=question, headers=owner)
+            uuids.append(response.json()["uuid"])
+            state["questions"].append((owner, uuids[-1]))
+        for number in range(quizzes):
+            chosen = rng.sample(uuids, min(len(uuids), rng.randint(1, 10)))
+            quiz = {"title": "Quiz {}".format(number), "questions": chosen}
+            response = await client.post("/api/v1/quizzes", json=quiz, headers=owner)
+            uuid = response.json()["uuid"]
+            await client.put("/api/v1/quizzes/" + uuid, json={"published": True}, headers=owner)
+            state["quizzes"].append((owner, uuid, len(chosen)))
+    for _, user in state["users"]:  # Each user solves the first quiz for the read mix, leaving the rest to submit
+        _, quiz, count = state["quizzes"][0]
+        response = await client.post("/api/v1/solutions", json={"quiz": quiz, "answers": [[True, False]] * count},
+                                     headers=user)
+        state["solutions"].append((user, response.json()["uuid"]))
+    state["pairs"] = [(user, quiz) for _, user in state["users"] for quiz in state["quizzes"][1:]]
+    rng.shuffle(state["pairs"])
+    return state
+
+
+async def mix_login(client, state: dict, number: int, latencies: dict):
+    email = state["users"][number % len(state["users"])][0]
+    await timed_request(client, latencies, "POST /token", "POST", "/token",
+                        data={"username": email, "password": "secret"})
+
+
+async def mix_crud(client, state: dict, number: int, latencies: dict):
+    owner = state["owners"][number % len(state["owners"])][1]
+    question = {"text": "Question {}".format(number), "answers": ["Yes", "No", "Maybe"],
+                "correct": [True, False, False]}
+    response = await timed_request(client, latencies, "POST /api/v1/questions", "POST", "/api/v1/questions",
+                                   json=question, headers=owner)
+    url = "/api/v1/questions/" + response.json()["uuid"]
+    await timed_request(client, latencies, "GET /api/v1/questions/{uuid}", "GET", url, headers=owner)
+    await timed_request(client, latencies, "PUT /api/v1/questions/{uuid}", "PUT", url,
+                        json={"text": "Updated {}".format(number)}, headers=owner)
+    await timed_request(client, latencies, "DELETE /api/v1/questions/{uuid}", "DELETE", url, headers=owner)
+
+
+async def mix_submit(client, state: dict, number: int, latencies: dict):
+    user, (_, quiz, questions) = state["pairs"][number % len(state["pairs"])]
+    solution = {"quiz": quiz, "answers": [[number % 2 == 0, number % 2 == 1]] * questions}
+    await timed_request(client, latencies, "POST /api/v1/solutions", "POST", "/api/v1/solutions",
+                        json=solution, headers=user)
+
+
+async def mix_list(client, state: dict, number: int, latencies: dict):
+    owner, quiz, _ = state["quizzes"][number % len(state["quizzes"])]
+    user = state["users"][number % len(state["users"])][1]
+    label, url, headers = (
+        ("GET /api/v1/questions", "/api/v1/questions", owner),
+        ("GET /api/v1/quizzes", "/api/v1/quizzes", owner),
+        ("GET /api/v1/solutions", "/api/v1/solutions", user),
+        ("GET /api/v1/quizzes/{uuid}/solutions", "/api/v1/quizzes/{}/solutions".format(quiz), owner),
+        ("GET /api/v1/quizzes/{uuid}/leaderboard", "/api/v1/quizzes/{}/leaderboard".format(quiz), user),
+    )[number % 5]
+    await timed_request(client, latencies, label, "GET", url, headers=headers)
+
+
+async def mix_read(client, state: dict, number: int, latencies: dict):
+    owner, question = state["questions"][number % len(state["questions"])]
+    quiz_owner, quiz, _ = state["quizzes"][number % len(state["quizzes"])]
+    user, solution = state["solutions"][number % len(state["solutions"])]
+    label, url, headers = (
+        ("GET /api/v1/questions/{uuid}", "/api/v1/questions/" + question, owner),
+        ("GET /api/v1/quizzes/{uuid}", "/api/v1/quizzes/" + quiz, quiz_owner),
+        ("GET /api/v1/solutions/{uuid}", "/api/v1/solutions/" + solution, user),
+    )[number % 3]
+    await timed_request(client, latencies, label, "GET", url, headers=headers)
+
+
+async def run_mix(client, mix, state: dict, requests: int, concurrency: int, start: int = 0):
+    """
+    Run requests operations of mix numbered from start, from concurrent clients,
+    returning elapsed time and latencies by endpoint.
+    """
+    latencies = {}
+    counter = iter(range(start, start + requests))
+
+    async def worker():
+        for number in counter:
+            await mix(client, state, number, latencies)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """Print regressions of results from baseline beyond tolerance, returning how many were found."""
+    regressions = 0
+    for mix, result in results.items():
+        base = baseline["mixes"].get(mix)
+        if not base:
+            continue
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            print("REGRESSION {} {:.0f} requests/sec, baseline {:.0f}".format(mix, result["rps"], base["rps"]))
+            regressions += 1
+        for label, endpoint in result["endpoints"].items():
+            base_endpoint = base["endpoints"].get(label)
+            if base_endpoint and endpoint["p50"] > base_endpoint["p50"] * (1 + tolerance):
+                print("REGRESSION {} {} p50 {:.2f} ms, baseline {:.2f} ms".format(
+                    mix, label, endpoint["p50"], base_endpoint["p50"]))
+                regressions += 1
+    return regressions
+
+
+async def bench_load(args):
+    import httpx
+    app = setup(args.fake, args.latency / 1000, args.backend)
+    rng = random.Random(args.seed)
+    mixes = {"login": mix_login, "crud": mix_crud, "submit": mix_submit, "list": mix_list, "read": mix_read}
+    results = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        state = await seed_load(client, rng, args.owners, args.users, args.questions, args.quizzes)
+        for name in args.mixes:
+            requests = name == "login" and args.logins or args.requests
+            if name == "submit":
+                requests = min(requests, len(state["pairs"]) // args.repeat)  # Each user can take each quiz once
+            best = None
+            for repeat in range(args.repeat):
+                run = await run_mix(client, mixes[name], state, requests, args.concurrency, repeat * requests)
+                if not best or run[0] < best[0]:
+                    best = run
+            elapsed, latencies = best
+            rps = sum(map(len, latencies.values())) / elapsed
+            print("{} {:.0f} requests/sec".format(name, rps))
+            results[name] = {"rps": rps, "endpoints": report(latencies, elapsed)}
+    options = dict((name, getattr(args, name)) for name in (
+        "fake", "latency", "backend", "concurrency", "requests", "logins", "repeat", "owners", "users", "questions",
+        "quizzes", "seed"))
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump({"options": options, "mixes": results}, file, indent=2)
+        print("Saved baseline to {}".format(args.save_baseline))
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline.get("options") != options:
+            print("Warning: options differ from baseline {}".format(baseline.get("options")))
+        regressions = compare(results, baseline, args.tolerance)
+        print("{} regressions against {} with tolerance {:.0%}".format(regressions, args.baseline, args.tolerance))
+        return regressions and 1 or 0
+
+
+async def bench_quizsave(args):
+    from models import Question, Quiz
+    setup(args.fake, args.latency / 1000, args.backend)
+    import storage
+    owner = shortuuid.uuid()
+    print("{:>9}  {:>10}  {:>10}  {:>10}".format("questions", "create ms", "update ms", "publish ms"))
+    for count in args.sizes:
+        uuids = []
+        for number in range(count):
+            question = Question(owner=owner, text="Question {}".format(number), answers=["Yes", "No"],
+                                correct=[True, False])
+            uuids.append((await storage.save_question(question)).uuid)
+        timings = {"create": [], "update": [], "publish": []}
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            quiz = await storage.save_quiz(Quiz(owner=owner, title="Bench", questions=uuids))
+            timings["create"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            await storage.save_quiz(Quiz(uuid=quiz.uuid, title="Bench updated"))
+            timings["update"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            await storage.save_quiz(Quiz(uuid=quiz.uuid, published=True))
+            timings["publish"].append(time.perf_counter() - start)
+        print("{:>9}  {:>10.2f}  {:>10.2f}  {:>10.2f}".format(
+            count, *(statistics.mean(timings[name]) * 1000 for name in ("create", "update", "publish"))))
+
+
+async def bench_scoring(args):
+    from models import CompiledQuiz, SolutionRec
+    from scoring import score_quiz, score_quiz_batch
+    rng = random.Random(args.seed)
+    correct = [[rng.random() < 0.4 for _ in range(rng.randint(2, 5))] for _ in range(args.questions)]
+    for question in correct:
+        question[0] = True
+        question[-1] = False  # At least one right and one wrong answer so every solution can be scored
+    quiz = CompiledQuiz(uuid="owner-quiz", owner="owner", title="Bench",
+                        questions=["owner-{}".format(number) for number in range(args.questions)],
+                        texts=["Question"] * args.questions, correct=correct)
+    answer_sets = []
+    for _ in range(args.solutions):
+        answers = [[False] * len(question) for question in correct]
+        for question, width in zip(answers, map(len, correct)):
+            question[rng.randrange(width)] = True  # One answer each so single answer questions are valid
+        answer_sets.append(answers)
+    solutions = [SolutionRec(answers=answers) for answers in answer_sets]
+
+    start = time.perf_counter()
+    individual = [score_quiz(quiz, solution).score for solution in solutions]
+    elapsed = time.perf_counter() - start
+    print("individual {:>10.0f} solutions/sec".format(args.solutions / elapsed))
+    start = time.perf_counter()
+    scores, totals, errors = score_quiz_batch(quiz, answer_sets)
+    elapsed = time.perf_counter() - start
+    print("batch      {:>10.0f} solutions/sec".format(args.solutions / elapsed))
+    if totals.tolist() != individual or any(errors):
+        raise RuntimeError("Batch scores differ from individual scores")
+
+
+def sample_records(rng: random.Random, count: int):
+    """Return lists of typical Questions, Quizzes, CompiledQuizzes and SolutionRecs by model name."""
+    from models import Question, Quiz, CompiledQuiz, SolutionRec
+    owner, user = shortuuid.uuid(), shortuuid.uuid()
+    questions = []
+    for number in range(10):
+        width = rng.randint(2, 6)
+        questions.append(Question(uuid="-".join((owner, shortuuid.uuid())), owner=owner,
+                                  text="Which of these is true of question {}?".format(number),
+                                  answers=["Answer {}".format(answer) for answer in range(width)],
+                                  correct=[rng.random() < 0.4 for _ in range(width)]))
+    uuids = [question.uuid for question in questions]
+    quiz = Quiz(uuid="-".join((owner, shortuuid.uuid())), owner=owner, published=True, title="Bench", questions=uuids)
+    compiled = CompiledQuiz(uuid=quiz.uuid, owner=owner, title=quiz.title, questions=uuids,
+                            texts=[question.text for question in questions],
+                            correct=[question.correct for question in questions])
+    scores = [rng.randint(-100, 100) for _ in questions]
+    solution = SolutionRec(uuid="-".join((user, quiz.uuid)), user=user, quiz=quiz.uuid, title=quiz.title,
+                           questions=compiled.texts, scores=scores, score=sum(scores) // len(scores),
+                           answers=[[rng.random() < 0.3 for _ in question.correct] for question in questions])
+    return {
+        "Question": [questions[number % len(questions)] for number in range(count)],
+        "Quiz": [quiz] * count,
+        "CompiledQuiz": [compiled] * count,
+        "SolutionRec": [solution] * count,
+    }
+
+
+async def bench_jwt(args):
+    os.environ.setdefault("JWT_SIGNATURE", "bench-" * 11)  # PyJWT warns on keys shorter than the hash
+    setup(True)
+    import auth
+    backends = {"jose": auth.JoseBackend()}
+    try:
+        backends["pyjwt"] = auth.PyJWTBackend()
+    except ImportError:
+        print("PyJWT not installed")
+    claims = {"sub": "bench@example.com", "exp": int(time.time()) + 3600}
+    for name, backend in backends.items():
+        auth.jwt_backend = backend
+        tokens = [backend.encode(dict(claims, uid=str(number))) for number in range(args.users)]
+        start = time.perf_counter()
+        for number in range(args.tokens):
+            backend.decode(tokens[number % len(tokens)])
+        elapsed = time.perf_counter() - start
+        print("{:<6} verified {:>10.0f} tokens/sec".format(name, args.tokens / elapsed))
+        auth.token_cache.clear()
+        start = time.perf_counter()
+        for number in range(args.tokens):
+            auth.decode_access_token(tokens[number % len(tokens)])
+        elapsed = time.perf_counter() - start
+        print("{:<6} cached   {:>10.0f} tokens/sec".format(name, args.tokens / elapsed))
+
+
+async def bench_codec(args):
+    import codec
+    records = sample_records(random.Random(args.seed), args.records)
+    print("{:<13} {:<8} {:>9}  {:>10}  {:>10}".format("model", "codec", "bytes", "encode us", "decode us"))
+    for name, instances in records.items():
+        model = type(instances[0])
+        for encoder in codec.codecs.values():
+            start = time.perf_counter()
+            encoded = [encoder.encode(instance) for instance in instances]
+            encode = (time.perf_counter() - start) / len(instances)
+            start = time.perf_counter()
+            decoded = [codec.decode(data, model) for data in encoded]
+            decode = (time.perf_counter() - start) / len(instances)
+            if decoded != instances:
+                raise RuntimeError("{} {} records differ after decoding".format(encoder.name, name))
+            size = statistics.mean(len(data) for data in encoded)
+            print("{:<13} {:<8} {:>9.0f}  {:>10.2f}  {:>10.2f}".format(
+                name, encoder.name, size, encode * 1e6, decode * 1e6))
+
+
+async def bench_responses(args):
+    import codec
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_response_field
+    from starlette.responses import JSONResponse
+    from models import Question, Quiz, Solution
+    records = sample_records(random.Random(args.seed), args.records)
+    print("{:<13} {:<8} {:>10}  {:>10}".format("model", "codec", "model us", "direct us"))
+    for name, model in (("Question", Question), ("Quiz", Quiz), ("SolutionRec", Solution)):
+        field = create_response_field(name="Response_" + model.__name__, type_=model)
+        for encoder in codec.codecs.values():
+            encoded = [encoder.encode(instance) for instance in records[name]]
+            start = time.perf_counter()  # As FastAPI returns a model instance with response_model validation
+            bodies = [JSONResponse(await serialize_response(field=field, response_content=codec.decode(data, model)))
+                      .body for data in encoded]
+            validated = (time.perf_counter() - start) / len(encoded)
+            start = time.perf_counter()
+            direct = [codec.response_json(data, model)[0] for data in encoded]
+            passed = (time.perf_counter() - start) / len(encoded)
+            if [json.loads(body) for body in direct] != [json.loads(body) for body in bodies]:
+                raise RuntimeError("{} {} responses differ".format(encoder.name, name))
+            print("{:<13} {:<8} {:>10.2f}  {:>10.2f}".format(name, encoder.name, validated * 1e6, passed * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fake", action="store_true", help="Use in-memory fakeredis instead of configured Redis")
+    parser.add_argument("--latency", type=float, default=0, help="Milliseconds added per fakeredis round trip")
+    parser.add_argument("--backend", choices=["redis", "memory"], default="redis", help="Storage backend")
+    benchmarks = parser.add_subparsers(dest="benchmark", required=True)
+    http = benchmarks.add_parser("http", help="Requests per second through the ASGI app")
+    http.add_argument("--requests", type=int, default=2000, help="Timed requests to issue")
+    http.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+    http.add_argument("--questions", type=int, default=20, help="Questions to seed for the owner")
+    quizsave = benchmarks.add_parser("quizsave", help="Quiz save latency by number of questions")
+    quizsave.add_argument("--sizes", type=int, nargs="+", default=[1, 2, 5, 10, 20], help="Questions per quiz")
+    quizsave.add_argument("--repeat", type=int, default=20, help="Saves timed per size")
+    scoring = benchmarks.add_parser("scoring", help="Individual and batch scoring throughput")
+    scoring.add_argument("--solutions", type=int, default=20000, help="Answer sets to score")
+    scoring.add_argument("--questions", type=int, default=10, help="Questions in the quiz")
+    scoring.add_argument("--seed", type=int, default=0)
+    load = benchmarks.add_parser("load", help="Latency and throughput by endpoint for mixes of operations")
+    load.add_argument("--mixes", nargs="+", default=["login", "crud", "submit", "list", "read"],
+                      choices=["login", "crud", "submit", "list", "read"], help="Mixes to run in turn")
+    load.add_argument("--requests", type=int, default=1000, help="Operations per mix, a CRUD operation is 4 requests")
+    load.add_argument("--logins", type=int, default=50, help="Logins timed, each a bcrypt password check")
+    load.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+    load.add_argument("--repeat", type=int, default=3, help="Runs of each mix, reporting the fastest to reduce noise")
+    load.add_argument("--owners", type=int, default=4, help="Users owning questions and quizzes")
+    load.add_argument("--users", type=int, default=20, help="Users taking quizzes")
+    load.add_argument("--questions", type=int, default=20, help="Questions per owner")
+    load.add_argument("--quizzes", type=int, default=10, help="Published quizzes per owner")
+    load.add_argument("--seed", type=int, default=0)
+    load.add_argument("--save-baseline", metavar="PATH", help="Save results as a JSON baseline")
+    load.add_argument("--baseline", metavar="PATH", help="Compare results with a JSON baseline, failing on regression")
+    load.add_argument("--tolerance", type=float, default=0.2,
+                      help="Fraction requests/sec may fall, or p50 latency rise, before a regression")
+    jwt = benchmarks.add_parser("jwt", help="Token verification throughput by backend, with and without caching")
+    jwt.add_argument("--tokens", type=int, default=20000, help="Tokens to verify")
+    jwt.add_argument("--users", type=int, default=100, help="Distinct tokens, as if reused by this many clients")
+    codec = benchmarks.add_parser("codec", help="Stored record size and encode and decode time by codec")
+    codec.add_argument("--records", type=int, default=10000, help="Records of each model to encode and decode")
+    codec.add_argument("--seed", type=int, default=0)
+    responses = benchmarks.add_parser("responses", help="Response time by model for individual records by codec")
+    responses.add_argument("--records", type=int, default=10000, help="Records of each model to respond with")
+    responses.add_argument("--seed", type=int, default=0)
+    # Accept common options after the benchmark name too
+    for benchmark in (http, load, quizsave, scoring, jwt, codec, responses):
+        benchmark.add_argument("--fake", action="store_true", default=argparse.SUPPRESS)
+        benchmark.add_argument("--latency", type=float, default=argparse.SUPPRESS)
+        benchmark.add_argument("--backend", choices=["redis", "memory"], default=argparse.SUPPRESS)
+    args = parser.parse_args()
+    return asyncio.run(globals()["bench_" + args.benchmark](args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
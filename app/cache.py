@@ -0,0 +1,66 @@
+"""
+Bounded in-process LRU caches with optional time to live, for records read on most requests.
+Each worker process has its own caches, so entries are kept short lived or immutable.
+Hit, miss and eviction counters are kept per cache for sizing and reported by stats().
+"""
+import time
+from collections import OrderedDict
+
+
+caches = []  # All caches created, for reporting
+
+
+class LRUCache:
+    """Least recently used cache holding up to size entries, each expiring after ttl seconds if ttl is set."""
+
+    def __init__(self, name: str, size: int, ttl: float = 0):
+        self.name = name
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key: (expiry, value)
+        self.hits = self.misses = self.evictions = 0
+        caches.append(self)
+
+    def get(self, key):
+        """Return cached value for key, or None if absent or expired."""
+        entry = self.entries.get(key)
+        if entry and (not entry[0] or entry[0] > time.monotonic()):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry:
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl: float = None):
+        """Cache value for key, expiring after ttl seconds if given, otherwise the cache ttl."""
+        if self.size <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        self.entries[key] = (ttl and time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        """Invalidate any cached value for key."""
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "capacity": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def stats():
+    """Return counters for all caches by name."""
+    return dict((cache.name, cache.stats()) for cache in caches)
@@ -0,0 +1,114 @@
+"""
+Serialization of model instances stored as Redis strings.
+
+Records are written with the codec selected by the REDIS_CODEC setting and read back with whichever codec wrote them,
+so the setting can be changed at any time without migrating existing records:
+
+- "json": The model JSON, as always stored. Legacy records have no tag and start with "{".
+- "msgpack": A two byte tag, the msgpack reserved byte 0xc1 and a format version, followed by a msgpack array of
+  field values in model field order. Lists of bools, e.g. Question.correct, are packed as bitmask ExtTypes.
+
+Values are positional, so new model fields must be appended with a default; older records then read with the default.
+Any other change to the layout needs a new version. Records are validated when written, so msgpack records are read
+without validation, which is where most of the parse time saving comes from.
+
+Responses of individual records are built from record data by response_json, skipping the model entirely:
+stored JSON with the response model's fields is sent as it is, and other records are serialised with orjson.
+"""
+import msgpack
+import orjson  # https://pypi.org/project/orjson/
+
+import metrics
+
+
+TAG = b"\xc1"  # Never used by msgpack and never starts JSON, so tagged records are recognised unambiguously
+MSGPACK_V1 = 1
+BITMASK = 1  # ExtType code of a packed list of bools
+
+
+def pack_bools(values: list):
+    """Return list of bools as ExtType holding a 2 byte count and bits, least significant first."""
+    bits = sum(1 << index for index, value in enumerate(values) if value)
+    return msgpack.ExtType(BITMASK, len(values).to_bytes(2, "big") + bits.to_bytes((len(values) + 7) // 8, "little"))
+
+
+def unpack_bools(data: bytes):
+    count, bits = int.from_bytes(data[:2], "big"), int.from_bytes(data[2:], "little")
+    return [bool(bits >> index & 1) for index in range(count)]
+
+
+def packable(value):
+    """Return value with every non-empty list of bools, at any depth of lists, replaced by a bitmask ExtType."""
+    if isinstance(value, list):
+        if value and all(item is True or item is False for item in value):
+            return pack_bools(value)
+        return [packable(item) for item in value]
+    return value
+
+
+def ext_hook(code: int, data: bytes):
+    if code == BITMASK:
+        return unpack_bools(data)
+    return msgpack.ExtType(code, data)
+
+
+class JSONCodec:
+    name = "json"
+
+    def encode(self, instance):
+        with metrics.timed("pydantic"):
+            return instance.json().encode('utf-8')
+
+
+class MsgpackCodec:
+    name = "msgpack"
+
+    def encode(self, instance):
+        with metrics.timed("pydantic"):
+            values = [packable(getattr(instance, field)) for field in instance.__fields__]
+            return TAG + bytes((MSGPACK_V1,)) + msgpack.packb(values, use_bin_type=True)
+
+
+codecs = {codec.name: codec for codec in (JSONCodec(), MsgpackCodec())}
+
+
+def get_codec(name: str):
+    """Return codec by name, raising ValueError for unknown names."""
+    if name not in codecs:
+        raise ValueError("Unknown codec '{}', expected one of {}".format(name, ", ".join(codecs)))
+    return codecs[name]
+
+
+def unpack(data: bytes, model):
+    """Return dict of field values of model from tagged msgpack record data, omitting fields appended since written."""
+    if data[1] != MSGPACK_V1:
+        raise ValueError("Unknown record format version {}".format(data[1]))
+    values = msgpack.unpackb(data[2:], raw=False, ext_hook=ext_hook)
+    return dict(zip(model.__fields__, values))
+
+
+def decode(data: bytes, model):
+    """Return model instance from record data written by any codec, including untagged legacy JSON."""
+    with metrics.timed("pydantic"):
+        if data[:1] != TAG:
+            return model.parse_raw(data)
+        return model.construct(**unpack(data, model))
+
+
+def response_json(data: bytes, model):
+    """
+    Return JSON response body of record data as model, and dict of its field values, without validation.
+    Stored JSON with exactly the fields of model is returned unchanged. Otherwise stored fields not in model,
+    such as SolutionRec.answers, are dropped, fields appended to model since the record was written take defaults,
+    and the values are serialised with orjson.
+    """
+    with metrics.timed("json"):
+        if data[:1] != TAG:
+            values = orjson.loads(data)
+            if values.keys() == model.__fields__.keys():
+                return data, values
+        else:
+            values = unpack(data, model)
+        values = {name: values[name] if name in values else field.get_default()
+                  for name, field in model.__fields__.items()}
+        return orjson.dumps(values), values
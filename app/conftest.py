@@ -0,0 +1,43 @@
+"""
+Shared test setup. Tests other than test_app.py run without Redis, against the storage backend selected by
+STORAGE_BACKEND, with fakeredis standing in for Redis, or the in-process backend::
+
+    pytest test_auth.py test_api.py
+    STORAGE_BACKEND=memory pytest test_auth.py test_api.py
+"""
+import os
+
+import pytest
+
+for name, value in (("REDIS_HOST", "localhost"), ("REDIS_PORT", "6379"), ("REDIS_PASSWORD", ""),
+                    ("JWT_SIGNATURE", "test-signature-" * 4)):
+    os.environ.setdefault(name, value)  # Settings are read from the environment when modules are imported
+
+
+@pytest.fixture
+def fresh_storage(monkeypatch):
+    """Return the selected storage backend emptied for the test, with fakeredis in place of Redis."""
+    import auth
+    import storage
+    backend = storage.backend
+    if backend.__name__ == "db":
+        import fakeredis.aioredis
+        monkeypatch.setattr(backend, "redis", fakeredis.aioredis.FakeRedis())
+        monkeypatch.setattr(backend, "revoked", {"expiry": 0, "generations": {}})
+        backend.user_cache.clear()
+        backend.quiz_cache.clear()
+    else:
+        backend.clear()
+    auth.token_cache.clear()
+    return backend
+
+
+@pytest.fixture
+def api_client(fresh_storage, monkeypatch):
+    """Return function creating a client that drives the app in-process, in the event loop using the storage."""
+    import bcrypt
+    import httpx
+    from main import app
+    gensalt = bcrypt.gensalt
+    monkeypatch.setattr(bcrypt, "gensalt", lambda: gensalt(4))  # Fewest rounds, registering users quickly
+    return lambda: httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
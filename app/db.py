@@ -1,205 +1,869 @@
 """
-Storage operations supported by Redis. Test environment runs on Redis Enterprise Cloud.
-Alternative back-ends can be used by replacing this module.
+Asynchronous storage operations supported by Redis using redis.asyncio. Test environment runs on Redis Enterprise Cloud.
+This is the default storage backend, implementing the Storage protocol of storage.py.
 Redis is a fast, object-oriented data store, with persistence and high availability options.
-FastAPI also supports immediate response, while Redis write is assigned to background tasks (not yet implemented).
+With REDIS_KEY_VERSION 2, keys carry hash tags keeping each owner's and each quiz's keys in one hash slot,
+which REDIS_CLUSTER needs. Transactions become plain pipelines in cluster mode, as keys of different owners can
+be in different slots, while each solution script runs atomically in the quiz's slot.
+With REDIS_WRITE_BEHIND set, new solutions are acknowledged once claimed, and their indexes, statistics and
+leaderboard entries are applied by a batched background writer (see SolutionWriter).
 Redis settings including Redis location and password are taken securely from the environment.
 """
+import time
+import asyncio
+import collections
+import logging
 import shortuuid
-import redis
-from models import RedisSettings, UserRec, Question, Quiz, Solution, SolutionRec
+import redis.asyncio
+import codec
+import metrics
+import records
+from cache import LRUCache
+from models import RedisSettings, CacheSettings, UserRec, Question, Quiz, CompiledQuiz, Solution, SolutionRec
+from models import LeaderboardEntry, QuizRank
+from records import update_question, update_quiz, compiled_quiz, encode_cursor, decode_cursor, solution_stats
 
 
-redis_settings = RedisSettings()
-redis = redis.Redis(
-    host=redis_settings.redis_host,
-    port=redis_settings.redis_port,
-    password=redis_settings.redis_password,
-)
+class InstrumentedPipeline(redis.asyncio.client.Pipeline):
+    """Pipeline counting its commands and timing its execution as one round trip."""
+
+    async def execute(self, raise_on_error: bool = True):
+        with metrics.count_redis(len(self.command_stack)):
+            return await super().execute(raise_on_error)
+
+
+class InstrumentedRedis(redis.asyncio.Redis):
+    """Redis client counting and timing each command as a round trip, and returning instrumented pipelines."""
+
+    async def execute_command(self, *args, **options):
+        with metrics.count_redis(1):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction: bool = True, shard_hint: str = None):
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class InstrumentedClusterPipeline(redis.asyncio.cluster.ClusterPipeline):
+    """Cluster pipeline counting its commands and timing its execution as one round trip, sent to each node."""
 
+    async def execute(self, raise_on_error: bool = True, allow_redirections: bool = True):
+        with metrics.count_redis(len(self)):
+            return await super().execute(raise_on_error, allow_redirections)
 
-def get_user(username: str):
+
+class InstrumentedRedisCluster(redis.asyncio.RedisCluster):
+    """Redis Cluster client counting and timing each command as a round trip, and returning instrumented pipelines."""
+
+    async def execute_command(self, *args, **options):
+        with metrics.count_redis(1):
+            return await super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=None, shard_hint=None):
+        if transaction or shard_hint:
+            # Left to redis-py, uninstrumented; transaction() never asks for a MULTI/EXEC pipeline in cluster mode
+            return super().pipeline(transaction, shard_hint)
+        return InstrumentedClusterPipeline(self)
+
+
+redis_settings = RedisSettings()
+if redis_settings.redis_key_version not in (1, 2):
+    raise ValueError("Unknown key version {}, expected 1 or 2".format(redis_settings.redis_key_version))
+if redis_settings.redis_cluster and redis_settings.redis_key_version != 2:
+    raise ValueError("Redis Cluster needs key version 2, see manage.py rekey")
+if redis_settings.redis_cluster:
+    redis = InstrumentedRedisCluster(
+        host=redis_settings.redis_host,
+        port=redis_settings.redis_port,
+        password=redis_settings.redis_password,
+        max_connections=redis_settings.redis_max_connections,  # Per node
+        socket_timeout=redis_settings.redis_socket_timeout,
+        socket_connect_timeout=redis_settings.redis_socket_timeout,
+        socket_keepalive=True,
+        health_check_interval=redis_settings.redis_health_check_interval,
+    )
+else:
+    redis = InstrumentedRedis(
+        connection_pool=redis.asyncio.BlockingConnectionPool(
+            host=redis_settings.redis_host,
+            port=redis_settings.redis_port,
+            password=redis_settings.redis_password,
+            max_connections=redis_settings.redis_max_connections,
+            timeout=redis_settings.redis_pool_timeout,  # Wait for a free connection rather than fail under load
+            socket_timeout=redis_settings.redis_socket_timeout,
+            socket_connect_timeout=redis_settings.redis_socket_timeout,
+            socket_keepalive=True,
+            health_check_interval=redis_settings.redis_health_check_interval,
+        )
+    )
+CLUSTER = redis_settings.redis_cluster
+KEY_VERSION = redis_settings.redis_key_version
+READ_CHUNK = redis_settings.redis_read_chunk
+WRITE_CHUNK = redis_settings.redis_write_chunk
+encoder = codec.get_codec(redis_settings.redis_codec)
+
+cache_settings = CacheSettings()
+user_cache = LRUCache("user", cache_settings.user_cache_size, cache_settings.user_cache_ttl)
+quiz_cache = LRUCache("quiz", cache_settings.quiz_cache_size, cache_settings.quiz_cache_ttl)
+logger = logging.getLogger(__name__)
+revoked = {"expiry": 0, "generations": {}}  # In-process copy of the "revoked" hash of user token generations
+
+# Version 2 keys wrap the hash tag of each key in braces, so Redis Cluster stores keys with the same tag in the same
+# hash slot. Records of an owner are tagged by owner UUID, and Solutions by quiz UUID along with the quiz's index,
+# statistics, leaderboard and pending solutions, keeping the keys of each multi-key operation together.
+OWNER_TAGGED = ("question", "quiz", "compiled", "published", "unpublished")
+QUIZ_TAGGED = ("solution",)
+REVOKED = KEY_VERSION == 2 and "v2:revoked" or "revoked"
+
+
+def key(prefix: str, uuid: str, version: int = None):
+    """Return Redis key for prefix and UUID (or email for users) in the configured or given key version."""
+    if (version or KEY_VERSION) == 1:
+        return prefix == "user" and "user:" + uuid or "-".join((prefix, uuid))
+    if prefix in OWNER_TAGGED:
+        owner, rest = uuid.split("-", 1)
+        return "v2:{}:{{{}}}-{}".format(prefix, owner, rest)
+    if prefix in QUIZ_TAGGED:
+        user, quiz = uuid.split("-", 1)
+        return "v2:{}:{}-{{{}}}".format(prefix, user, quiz)
+    return "v2:{}:{{{}}}".format(prefix, uuid)
+
+
+def key_pattern(prefix: str, version: int = None):
+    """Return SCAN pattern matching every key with prefix in the configured or given key version."""
+    if (version or KEY_VERSION) == 1:
+        return prefix == "user" and "user:*" or prefix + "-*"
+    return "v2:{}:*".format(prefix)
+
+
+def key_uuid(key: str, version: int = None):
+    """Return UUID (or email for users) of Redis key in the configured or given key version."""
+    if (version or KEY_VERSION) == 1:
+        return key.startswith("user:") and key[5:] or key.split("-", 1)[1]
+    return key.split(":", 2)[2].replace("{", "").replace("}", "")
+
+
+def transaction():
+    """Return pipeline executed as a MULTI/EXEC transaction, or a plain pipeline in cluster mode."""
+    return redis.pipeline(transaction=not CLUSTER)
+
+
+async def mget(keys: list):
+    """Return values of keys, in one round trip, or one per hash slot in cluster mode."""
+    if CLUSTER:
+        return await redis.mget_nonatomic(keys)
+    return await redis.mget(keys)
+
+
+async def script_pipeline(script):
+    """
+    Return pipeline for calling script, each call atomic by itself.
+    Cluster pipelines do not load missing scripts, so the script is first loaded on every primary.
+    """
+    if CLUSTER:
+        await redis.script_load(script.script)
+    return redis.pipeline(transaction=False)
+
+
+async def get_user(username: str):
     """Lookup username (email) in Redis user database and return UserRec object stored as Redis hash."""
-    user = redis.hgetall("user:" + username)  # dict as bytes
+    user = await redis.hgetall(key("user", username))  # dict as bytes
     if user:
         user = dict((k.decode('utf-8'), v) for k, v in user.items())
         user = UserRec.parse_obj(user)
     return user
 
-def save_user(user: dict):
+
+async def get_cached_user(username: str):
+    """Return UserRec for username (email) from short lived in-process cache, looking up Redis on a miss."""
+    user = user_cache.get(username)
+    if not user:
+        user = await get_user(username)
+        if user:
+            user_cache.set(username, user)
+    return user
+
+async def save_user(user: dict):
     """Create new User."""
     user = UserRec(**user)
     user.uuid = shortuuid.uuid()
-    redis.hmset("user:" + user.email, user.dict())
+    await redis.hmset(key("user", user.email), user.dict())
+    user_cache.pop(user.email)
+    return user
+
+
+async def deactivate_user(username: str):
+    """Mark existing User inactive, returning updated UserRec or None if not found."""
+    user = await get_user(username)
+    if not user:
+        return None
+    user.active = 0
+    pipe = transaction()
+    pipe.hset(key("user", username), "active", user.active)
+    pipe.hincrby(REVOKED, user.uuid, 1)
+    _, revoked["generations"][user.uuid] = await pipe.execute()
+    user_cache.pop(username)
     return user
 
 
+async def revoke_user_tokens(username: str):
+    """Revoke all tokens issued to existing User so far, returning UserRec or None if not found."""
+    user = await get_user(username)
+    if not user:
+        return None
+    revoked["generations"][user.uuid] = await redis.hincrby(REVOKED, user.uuid, 1)
+    user_cache.pop(username)
+    return user
 
-def publish_question(uuid: str, quiz: str):
-    """Record question as published in given quiz uuid."""
-    redis.sadd("-".join(("published", uuid)), quiz)
-    redis.srem("-".join(("unpublished", uuid)), quiz)
 
+async def token_generation(uuid: str):
+    """Return current token generation of User UUID, packed in new tokens so later revocations deny them."""
+    return int(await redis.hget(REVOKED, uuid) or 0)
 
-def unpublish_question(uuid: str, quiz: str):
-    """Record question as used in unpublished quiz."""
-    redis.sadd("-".join(("unpublished", uuid)), quiz)
-    redis.srem("-".join(("published", uuid)), quiz)
 
+async def revoked_generations():
+    """
+    Return dict of User UUID to token generation, where tokens of earlier generations are revoked.
+    The small "revoked" hash is copied in-process and refreshed every revoked_cache_ttl seconds,
+    so checking tokens normally needs no Redis round trip. Concurrent requests use the old copy during a refresh.
+    """
+    if revoked["expiry"] <= time.monotonic():
+        revoked["expiry"] = time.monotonic() + cache_settings.revoked_cache_ttl
+        try:
+            generations = await redis.hgetall(REVOKED)
+        except Exception:
+            revoked["expiry"] = 0
+            raise
+        revoked["generations"] = dict((uuid.decode('utf-8'), int(gen)) for uuid, gen in generations.items())
+    return revoked["generations"]
 
-def depublish_question(uuid: str, quiz: str):
-    """Remove question from a quiz altogether."""
-    redis.srem("-".join(("unpublished", uuid)), quiz)
-    redis.srem("-".join(("published", uuid)), quiz)
 
 
-def is_published_question(uuid: str):
+def publish_question(pipe, uuid: str, quiz: str):
+    """Queue on pipeline recording question as published in given quiz uuid."""
+    pipe.sadd(key("published", uuid), quiz)
+    pipe.srem(key("unpublished", uuid), quiz)
+
+
+def unpublish_question(pipe, uuid: str, quiz: str):
+    """Queue on pipeline recording question as used in unpublished quiz."""
+    pipe.sadd(key("unpublished", uuid), quiz)
+    pipe.srem(key("published", uuid), quiz)
+
+
+def depublish_question(pipe, uuid: str, quiz: str):
+    """Queue on pipeline removing question from a quiz altogether."""
+    pipe.srem(key("unpublished", uuid), quiz)
+    pipe.srem(key("published", uuid), quiz)
+
+
+async def is_published_question(uuid: str):
     """Return True if question is published, False if only in unpublished quizzes, None if unused orphan."""
-    if redis.scard("-".join(("published", uuid))):
+    if await redis.scard(key("published", uuid)):
         return True
-    if redis.scard("-".join(("unpublished", uuid))):
+    if await redis.scard(key("unpublished", uuid)):
         return False
     return None
 
 
 
-def exists_by_uuid(prefix: str, uuid: str):
+async def exists_by_uuid(prefix: str, uuid: str):
     """Return whether given prefixed UUID exists in Redis as a key."""
-    return redis.exists("-".join((prefix, uuid)))
+    return await redis.exists(key(prefix, uuid))
 
 
-def read_by_uuid(prefix: str, uuid: str, model):
-    """Retrieve given model instance from Redis JSON string at prefixed UUID."""
-    json = redis.get("-".join((prefix, uuid)))
-    if json:
-        return model.parse_raw(json)
+async def read_by_uuid(prefix: str, uuid: str, model):
+    """Retrieve given model instance from Redis string at prefixed UUID."""
+    data = await redis.get(key(prefix, uuid))
+    if data:
+        return codec.decode(data, model)
     return None
 
 
-def save_by_uuid(prefix: str, instance):
-    """Save any model instance in Redis string as JSON under prefixed UUID."""
-    key = "-".join((prefix, instance.uuid))
-    redis.set(key, instance.json())
+async def read_data_by_uuid(prefix: str, uuid: str):
+    """Return stored bytes of record at prefixed UUID, or None."""
+    return await redis.get(key(prefix, uuid))
+
 
+async def read_many_by_uuid(prefix: str, uuids: list, model):
+    """Retrieve model instances from Redis in chunked MGET batches, skipping any UUIDs no longer present."""
+    instances = []
+    for start in range(0, len(uuids), READ_CHUNK):
+        keys = [key(prefix, uuid) for uuid in uuids[start:start + READ_CHUNK]]
+        instances.extend(codec.decode(data, model) for data in await mget(keys) if data)
+    return instances
 
-def remove_by_uuid(prefix: str, uuid: str):
+
+async def save_by_uuid(prefix: str, instance):
+    """Save any model instance in Redis string under prefixed UUID, encoded with the configured codec."""
+    await redis.set(key(prefix, instance.uuid), encoder.encode(instance))
+
+
+async def remove_by_uuid(prefix: str, uuid: str):
     """Remove any model instance Redis string under prefixed UUID."""
-    key = "-".join((prefix, uuid))
-    redis.delete(key)
+    await redis.delete(key(prefix, uuid))
+
+
+async def index_uuid(index: str, owner: str, uuid: str, created: float = None):
+    """Add UUID to sorted set index for owner ordered by creation time, keeping the original time if present."""
+    await redis.zadd(key(index, owner), {uuid: created or time.time()}, nx=True)
+
+
+async def unindex_uuid(index: str, owner: str, uuid: str):
+    """Remove UUID from sorted set index for owner."""
+    await redis.zrem(key(index, owner), uuid)
+
 
+async def indexed_page(index: str, owner: str, limit: int, cursor: str = ""):
+    """
+    Return page of up to limit UUIDs from sorted set index for owner following cursor, and cursor for next page.
+    Next cursor is empty on the last page. Cost is O(log N + limit) regardless of index size.
+    """
+    zset = key(index, owner)
+    start = 0
+    if cursor:
+        created, uuid = decode_cursor(cursor)
+        rank = await redis.zrank(zset, uuid)
+        start = rank + 1 if rank is not None else await redis.zcount(zset, "-inf", created)  # Resume after removed UUID
+    entries = await redis.zrange(zset, start, start + limit, withscores=True)  # One extra entry shows more pages follow
+    next_cursor = ""
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = encode_cursor(entries[-1][1], entries[-1][0].decode('utf-8'))
+    return [uuid.decode('utf-8') for uuid, created in entries], next_cursor
 
 
-def read_question(uuid: str):
-    return read_by_uuid("question", uuid, Question)
+async def read_indexed(prefix: str, index: str, owner: str, model, limit: int, cursor: str = ""):
+    """Return page of model instances listed in index for owner, skipping any since removed, and next cursor."""
+    uuids, next_cursor = await indexed_page(index, owner, limit, cursor)
+    return await read_many_by_uuid(prefix, uuids, model), next_cursor
 
 
-def save_question(question: Question):
+
+async def read_question(uuid: str):
+    return await read_by_uuid("question", uuid, Question)
+
+
+async def read_question_data(uuid: str):
+    return await read_data_by_uuid("question", uuid)
+
+
+async def save_question(question: Question):
     # Update existing question
     if question.uuid:
-        old_question = read_question(question.uuid)
+        old_question = await read_question(question.uuid)
         if not old_question:
             return None
-        question.owner = old_question.owner
-        question.text = question.text or old_question.text
-        question.answers = question.answers or old_question.answers
-        question.correct = question.correct or old_question.correct
-        if len(question.answers) > len(question.correct):
-            question.answers = question.answers[0:len(question.correct)]
-        elif len(question.answers) < len(question.correct):
-            question.correct = question.correct[0:len(question.answers)]
+        update_question(question, old_question)
     # Create new question
     else:
         question.uuid = "-".join((question.owner, shortuuid.uuid()))
     # Save updated or new question
-    save_by_uuid("question", question)
+    await save_by_uuid("question", question)
+    await index_uuid("questions", question.owner, question.uuid)
     return question
 
 
-def remove_question(uuid: str):
-    question = read_question(uuid)
-    remove_by_uuid("question", uuid)
+async def remove_question(uuid: str):
+    question = await read_question(uuid)
+    await remove_by_uuid("question", uuid)
+    await unindex_uuid("questions", uuid.split("-", 1)[0], uuid)
     return question
 
 
-def user_questions(owner: str):
-    """Return all Questions owned by UUID owner."""
-    keys = redis.keys("-".join(("question", owner, "*")))
-    return [Question.parse_raw(redis.get(key)) for key in keys]
+async def user_questions(owner: str, limit: int, cursor: str = ""):
+    """Return page of Questions owned by UUID owner in creation order and cursor for next page."""
+    return await read_indexed("question", "questions", owner, Question, limit, cursor)
+
+
 
+async def read_quiz(uuid: str):
+    return await read_by_uuid("quiz", uuid, Quiz)
 
 
-def read_quiz(uuid: str):
-    return read_by_uuid("quiz", uuid, Quiz)
+async def read_quiz_data(uuid: str):
+    return await read_data_by_uuid("quiz", uuid)
 
 
-def save_quiz(quiz: Quiz):
+async def save_quiz(quiz: Quiz):
+    """
+    Create or update Quiz. The quiz record, its index, question publish states and any compiled snapshot
+    are written together in a single MULTI/EXEC transaction.
+    """
+    pipe = transaction()
+    compiled = None
     # Update existing quiz
     if quiz.uuid:
-        old_quiz = read_quiz(quiz.uuid)
+        old_quiz = await read_quiz(quiz.uuid)
         if not old_quiz or old_quiz.published:
             return None
-        quiz.owner = old_quiz.owner
-        quiz.title = quiz.title or old_quiz.title
-        quiz.questions = quiz.questions or old_quiz.questions
+        update_quiz(quiz, old_quiz)
         for uuid in set(old_quiz.questions) - set(quiz.questions):
-            depublish_question(uuid, quiz.uuid)
+            depublish_question(pipe, uuid, quiz.uuid)
         publish_or_unpublish_question = quiz.published and publish_question or unpublish_question
         for uuid in quiz.questions:
-            publish_or_unpublish_question(uuid, quiz.uuid)
+            publish_or_unpublish_question(pipe, uuid, quiz.uuid)
+        if quiz.published:
+            compiled = await build_compiled_quiz(quiz)
+            if compiled:
+                pipe.set(key("compiled", quiz.uuid), encoder.encode(compiled))
     # Create new quiz
     else:
         quiz.uuid = "-".join((quiz.owner, shortuuid.uuid()))
         quiz.published = False
         for uuid in quiz.questions:
-            unpublish_question(uuid, quiz.uuid)
+            unpublish_question(pipe, uuid, quiz.uuid)
     # Save updated or new quiz
-    save_by_uuid("quiz", quiz)
+    pipe.set(key("quiz", quiz.uuid), encoder.encode(quiz))
+    pipe.zadd(key("quizzes", quiz.owner), {quiz.uuid: time.time()}, nx=True)
+    await pipe.execute()
+    if compiled:
+        quiz_cache.set(quiz.uuid, compiled)
     return quiz
 
 
-def remove_quiz(uuid: str):
-    quiz = read_quiz(uuid)
+async def remove_quiz(uuid: str):
+    """Remove Quiz with its index entry, compiled snapshot and question publish states in one transaction."""
+    quiz = await read_quiz(uuid)
     if not quiz:
         return None
-    remove_by_uuid("quiz", uuid)
-    for uuid in quiz.questions:
-        depublish_question(uuid, quiz.uuid)
+    pipe = transaction()
+    pipe.delete(key("quiz", uuid), key("compiled", uuid))
+    pipe.zrem(key("quizzes", quiz.owner), uuid)
+    for question in quiz.questions:
+        depublish_question(pipe, question, uuid)
+    await pipe.execute()
+    quiz_cache.pop(uuid)
     return quiz
 
 
-def user_quizzes(owner: str):
-    """Return all Quizzes owned by UUID owner."""
-    keys = redis.keys("-".join(("quiz", owner, "*")))
-    return [Quiz.parse_raw(redis.get(key)) for key in keys]
+async def build_compiled_quiz(quiz: Quiz):
+    """Return CompiledQuiz snapshot of Quiz with its Questions, or None if any Question is missing."""
+    questions = await read_many_by_uuid("question", quiz.questions, Question)
+    if [question.uuid for question in questions] != quiz.questions:
+        return None
+    return compiled_quiz(quiz, questions)
+
+
+async def compile_quiz(quiz: Quiz):
+    """Compile and store snapshot of published Quiz, or return None if any Question is missing."""
+    compiled = await build_compiled_quiz(quiz)
+    if compiled:
+        await save_by_uuid("compiled", compiled)
+        quiz_cache.set(quiz.uuid, compiled)
+    return compiled
+
+
+async def read_compiled_quiz(uuid: str):
+    """
+    Return CompiledQuiz for published Quiz from in-process cache, or its stored snapshot on a miss.
+    Published quizzes without a snapshot are compiled on first use. Return None if not published or not compilable.
+    """
+    compiled = quiz_cache.get(uuid)
+    if not compiled:
+        compiled = await read_by_uuid("compiled", uuid, CompiledQuiz)
+        if compiled:
+            quiz_cache.set(uuid, compiled)
+        else:
+            quiz = await read_quiz(uuid)
+            if quiz and quiz.published:
+                compiled = await compile_quiz(quiz)
+    return compiled
+
+
+async def import_questions_quizzes(questions: list, quizzes: list):
+    """
+    Save new Questions, and new Quizzes each given as a pair of Quiz and list of its new Questions, assigning UUIDs.
+    Records with their indexes, publish states and compiled snapshots are written in pipelined chunks
+    of about WRITE_CHUNK commands, keeping each quiz's commands together. Chunks are not transactions.
+    """
+    pipe = redis.pipeline(transaction=False)
+
+    def save(prefix: str, index: str, instance):
+        pipe.set(key(prefix, instance.uuid), encoder.encode(instance))
+        pipe.zadd(key(index, instance.owner), {instance.uuid: time.time()}, nx=True)
+
+    for question in questions:
+        question.uuid = "-".join((question.owner, shortuuid.uuid()))
+        save("question", "questions", question)
+        if len(pipe) >= WRITE_CHUNK:
+            await pipe.execute()
+    for quiz, quiz_questions in quizzes:
+        quiz.uuid = "-".join((quiz.owner, shortuuid.uuid()))
+        quiz.questions = []
+        publish_or_unpublish_question = quiz.published and publish_question or unpublish_question
+        for question in quiz_questions:
+            question.uuid = "-".join((question.owner, shortuuid.uuid()))
+            quiz.questions.append(question.uuid)
+            save("question", "questions", question)
+            publish_or_unpublish_question(pipe, question.uuid, quiz.uuid)
+        save("quiz", "quizzes", quiz)
+        if quiz.published:
+            pipe.set(key("compiled", quiz.uuid), encoder.encode(compiled_quiz(quiz, quiz_questions)))
+        if len(pipe) >= WRITE_CHUNK:
+            await pipe.execute()
+    if len(pipe):
+        await pipe.execute()
+    return questions, quizzes
+
+
+async def user_quizzes(owner: str, limit: int, cursor: str = ""):
+    """Return page of Quizzes owned by UUID owner in creation order and cursor for next page."""
+    return await read_indexed("quiz", "quizzes", owner, Quiz, limit, cursor)
+
+
 
+async def exists_solution(uuid: str):
+    return await exists_by_uuid("solution", uuid)
 
 
-def exists_solution(uuid: str):
-    return exists_by_uuid("solution", uuid)
+async def read_solution(uuid: str):
+    return await read_by_uuid("solution", uuid, Solution)
 
 
-def read_solution(uuid: str):
-    return read_by_uuid("solution", uuid, Solution)
+async def read_solution_data(uuid: str):
+    return await read_data_by_uuid("solution", uuid)
 
 
-def save_solution(solution: SolutionRec):
-    if exists_solution(solution.uuid):
+# Index solution for quiz, rank the user's score on the quiz leaderboard and update quiz statistics,
+# given as pairs of hash field and increment from ARGV[6], then index solution for user if KEYS[5] is given.
+# KEYS[1] is reserved for the key guarding the updates.
+UPDATE_SOLUTION_LUA = """
+redis.call('ZADD', KEYS[2], 'NX', ARGV[2], ARGV[3])
+redis.call('ZADD', KEYS[4], ARGV[5], ARGV[4])
+for i = 6, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[3], ARGV[i], ARGV[i + 1])
+end
+if KEYS[5] then
+    redis.call('ZADD', KEYS[5], 'NX', ARGV[2], ARGV[3])
+end
+return 1
+"""
+# Save solution only if not already present, with its updates in the same atomic operation.
+SAVE_SOLUTION_LUA = """
+if not redis.call('SET', KEYS[1], ARGV[1], 'NX') then
+    return 0
+end
+""" + UPDATE_SOLUTION_LUA
+save_solution_script = redis.register_script(SAVE_SOLUTION_LUA)
+# Write behind: save solution only if not already present, queueing its pending entry for the updates,
+# and registering the pending list KEYS[2] in KEYS[3], left out in cluster mode for register_pending.
+CLAIM_SOLUTION_LUA = """
+if not redis.call('SET', KEYS[1], ARGV[1], 'NX') then
+    return 0
+end
+redis.call('RPUSH', KEYS[2], ARGV[2])
+if KEYS[3] then
+    redis.call('SADD', KEYS[3], KEYS[2])
+end
+return 1
+"""
+claim_solution_script = redis.register_script(CLAIM_SOLUTION_LUA)
+# Write behind: apply updates only if the pending entry ARGV[1] is still queued in KEYS[1], so each applies once.
+APPLY_SOLUTION_LUA = """
+if redis.call('LREM', KEYS[1], 1, ARGV[1]) == 0 then
+    return 0
+end
+""" + UPDATE_SOLUTION_LUA
+apply_solution_script = redis.register_script(APPLY_SOLUTION_LUA)
+PENDING_SOLUTIONS = "pending_solutions"  # Prefix of the list of pending entries for each quiz
+PENDING_LISTS = KEY_VERSION == 2 and "v2:pending_lists" or "pending_lists"  # Set of every pending list
+
+
+def save_solution_keys_args(solution: SolutionRec, entry: str = None, pending: str = None):
+    """
+    Return keys and arguments for the save solution script, or given the pending entry and the list holding it,
+    for the apply solution script. Every key is in the quiz's hash slot, except the user index,
+    which is left out in cluster mode for index_user_solution.
+    """
+    if entry is None:
+        keys, first, created = [key("solution", solution.uuid)], encoder.encode(solution), time.time()
+    else:
+        keys, first, created = [pending], entry, float(entry.split(" ", 1)[0])
+    keys.extend(key(prefix, solution.quiz) for prefix in ("quiz_solutions", "stats", "leaderboard"))
+    if not CLUSTER:
+        keys.append(key("solutions", solution.user))
+    args = [first, created, solution.uuid, solution.user, solution.score]
+    for field, increment in solution_stats(solution).items():
+        args.extend((field, increment))
+    return keys, args
+
+
+def claim_solution_keys_args(solution: SolutionRec):
+    """
+    Return keys and arguments for the claim solution script, with the pending entry last.
+    The pending list registry is in another hash slot, so is left out in cluster mode for register_pending.
+    """
+    entry = "{} {}".format(repr(time.time()), solution.uuid)  # Created time and UUID
+    keys = [key("solution", solution.uuid), key(PENDING_SOLUTIONS, solution.quiz)]
+    if not CLUSTER:
+        keys.append(PENDING_LISTS)
+    return keys, [encoder.encode(solution), entry]
+
+
+def register_pending(client, solution: SolutionRec):
+    """Register the pending list of Solution's quiz for recovery, queued on pipeline or awaitable from client."""
+    return client.sadd(PENDING_LISTS, key(PENDING_SOLUTIONS, solution.quiz))
+
+
+def index_user_solution(client, solution: SolutionRec, created: float):
+    """Index Solution for its user, queued on pipeline or awaitable from client, keeping any earlier entry."""
+    return client.zadd(key("solutions", solution.user), {solution.uuid: created}, nx=True)
+
+
+class SolutionWriter:
+    """
+    Background writer applying the updates of claimed solutions: indexes, quiz statistics and leaderboards.
+
+    A claim atomically saves the solution record, only if new, and appends its pending entry to a Redis list
+    for the quiz, so acknowledged solutions are stored and their updates are never lost. Claimed solutions are queued
+    in-process and applied in pipelined batches. Each update runs only if it removes its pending entry,
+    so entries left by a stopped worker can be recovered by any worker on startup without applying twice.
+    Pending lists are registered in a set as they are claimed into, so recovery reads them without scanning.
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue()  # (claimed at, pending list, pending entry, Solution)
+        self.claimed = collections.deque()  # Claim times of solutions queued or being applied, oldest first
+        self.task = None
+        self.depth = metrics.Gauge("solution_writer_queue_depth", "Solutions claimed awaiting their updates",
+                                   self.queue.qsize)
+        self.age = metrics.Gauge("solution_writer_lag_seconds", "Age of the oldest claimed solution not yet applied",
+                                 self.lag)
+        self.applied = metrics.Histogram("solution_writer_apply_lag_seconds",
+                                         "Seconds from claim to updates applied")
+
+    def lag(self):
+        return self.claimed and time.time() - self.claimed[0] or 0
+
+    def put(self, entry: str, solution: Solution, pending: str = None):
+        """Queue the updates of claimed Solution, claimed at the created time of its pending entry."""
+        pending = pending or key(PENDING_SOLUTIONS, solution.quiz)
+        claimed = float(entry.split(" ", 1)[0])
+        self.queue.put_nowait((claimed, pending, entry, solution))
+        self.claimed.append(claimed)
+        if not self.task:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < WRITE_CHUNK and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            while True:
+                try:
+                    await self.apply(batch)
+                    break
+                except Exception:
+                    logger.exception("Solution updates failed, retrying")
+                    await asyncio.sleep(1)
+            for _ in batch:
+                self.claimed.popleft()
+                self.queue.task_done()
+
+    async def apply(self, batch: list):
+        pipe = await script_pipeline(apply_solution_script)
+        for _, pending, entry, solution in batch:
+            keys, args = save_solution_keys_args(solution, entry, pending)
+            await apply_solution_script(keys=keys, args=args, client=pipe)
+            if CLUSTER:
+                index_user_solution(pipe, solution, args[1])
+        await pipe.execute()
+        now = time.time()
+        for claimed, _, _, _ in batch:
+            self.applied.observe(now - claimed)
+
+    async def recover(self):
+        """Queue pending entries left in Redis, e.g. by a stopped worker, returning how many were found."""
+        pendings = sorted(pending.decode('utf-8') for pending in await redis.smembers(PENDING_LISTS))
+        count = 0
+        for pending in pendings:
+            entries = [entry.decode('utf-8') for entry in await redis.lrange(pending, 0, -1)]
+            count += len(entries)
+            for start in range(0, len(entries), READ_CHUNK):
+                chunk = entries[start:start + READ_CHUNK]
+                keys = [key("solution", entry.split(" ", 1)[1]) for entry in chunk]
+                for entry, data in zip(chunk, await mget(keys)):
+                    if data:
+                        self.put(entry, codec.decode(data, Solution), pending=pending)
+                    else:
+                        await redis.lrem(pending, 1, entry)
+        return count
+
+    async def flush(self, timeout: float = None):
+        """Wait until every queued solution has been applied, or for timeout seconds, returning True if all were."""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self, timeout: float):
+        """
+        Apply queued solutions for up to timeout seconds, then stop the writer.
+        Solutions not yet applied stay in their pending lists, to be recovered by the next worker to start.
+        """
+        if not await self.flush(timeout):
+            logger.warning("Solution writer stopping before applying every solution, the rest stay pending")
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+
+solution_writer = SolutionWriter()
+
+
+async def start():
+    """With write behind, recover solutions left pending, e.g. by a stopped worker."""
+    if redis_settings.redis_write_behind:
+        await solution_writer.recover()
+
+
+async def stop():
+    """Apply solutions still queued by write behind, for up to REDIS_WRITE_BEHIND_TIMEOUT seconds."""
+    await solution_writer.stop(redis_settings.redis_write_behind_timeout)
+
+
+async def save_solution(solution: SolutionRec):
+    """
+    Atomically save new Solution with its indexes in one round trip, returning None if already solved.
+    In cluster mode the user index, in another hash slot, takes a second round trip.
+    With write behind, only claim the Solution, leaving its indexes to the solution writer.
+    """
+    if redis_settings.redis_write_behind:
+        keys, args = claim_solution_keys_args(solution)
+        if CLUSTER:
+            await register_pending(redis, solution)  # First, so a claimed entry is always registered
+        if not await claim_solution_script(keys=keys, args=args, client=redis):
+            return None
+        solution_writer.put(args[-1], solution)
+        return solution
+    keys, args = save_solution_keys_args(solution)
+    if not await save_solution_script(keys=keys, args=args, client=redis):
         return None
-    save_by_uuid("solution", solution)
+    if CLUSTER:
+        await index_user_solution(redis, solution, args[1])
     return solution
 
 
-def remove_solution(uuid: str):
+async def save_solutions(solutions: list):
+    """
+    Atomically save each new Solution with its indexes, pipelining the saves in chunks.
+    Return list of saved Solution, or None where already solved, in the same order.
+    """
+    saved = []
+    write_behind = redis_settings.redis_write_behind
+    script = write_behind and claim_solution_script or save_solution_script
+    for start in range(0, len(solutions), WRITE_CHUNK):
+        chunk = solutions[start:start + WRITE_CHUNK]
+        entries = []
+        pipe = await script_pipeline(script)
+        for solution in chunk:
+            if write_behind:
+                keys, args = claim_solution_keys_args(solution)
+                entries.append(args[-1])
+                if CLUSTER:
+                    register_pending(pipe, solution)  # Idempotent, so queued whether claimed or not
+            else:
+                keys, args = save_solution_keys_args(solution)
+            await script(keys=keys, args=args, client=pipe)
+            if CLUSTER and not write_behind:
+                index_user_solution(pipe, solution, args[1])  # Idempotent, so queued whether saved or not
+        results = await pipe.execute()
+        if CLUSTER:
+            results = write_behind and results[1::2] or results[::2]
+        saved.extend(solution if result else None for solution, result in zip(chunk, results))
+        for solution, result, entry in zip(chunk, results, entries):
+            if result:
+                solution_writer.put(entry, solution)
+    return saved
+
+
+async def remove_solution(uuid: str):
     raise NotImplementedError("Removing solutions is not supported")
 
 
-def user_solutions(user: str):
-    """Return all Solutions recorded for all Quizzes completed by UUID user."""
-    keys = redis.keys("-".join(("solution", user)) + "*")
-    return [Solution.parse_raw(redis.get(key)) for key in keys]
-
-
-def quiz_solutions(owner: str, quiz: str):
-    """Return all Solutions recorded for UUID quiz owned by UUID owner."""
-    keys = redis.keys("-".join(("solution", "*", owner, quiz)))
-    return [Solution.parse_raw(redis.get(key)) for key in keys]
+async def user_solutions(user: str, limit: int, cursor: str = ""):
+    """Return page of Solutions recorded for all Quizzes completed by UUID user and cursor for next page."""
+    return await read_indexed("solution", "solutions", user, Solution, limit, cursor)
+
+
+async def quiz_solutions(owner: str, quiz: str, limit: int, cursor: str = ""):
+    """Return page of Solutions recorded for UUID quiz owned by UUID owner and cursor for next page."""
+    if quiz.split("-", 1)[0] != owner:
+        return [], ""
+    return await read_indexed("solution", "quiz_solutions", quiz, Solution, limit, cursor)
+
+
+
+async def iter_quiz_solutions(owner: str, quiz: str):
+    """Asynchronously yield lists of Solutions recorded for UUID quiz owned by UUID owner, one chunk at a time."""
+    cursor = None
+    while cursor != "":
+        solutions, cursor = await quiz_solutions(owner, quiz, READ_CHUNK, cursor or "")
+        if solutions:
+            yield solutions
+
+
+async def quiz_stats(quiz: str):
+    """Return QuizStats for UUID quiz from its running statistics, in constant time regardless of solutions."""
+    stats = await redis.hgetall(key("stats", quiz))
+    stats = dict((field.decode('utf-8'), int(value)) for field, value in stats.items())
+    return records.quiz_stats(quiz, stats, await read_compiled_quiz(quiz))
+
+
+async def rebuild_quiz_stats(quiz: str):
+    """
+    Recompute running statistics and leaderboard for UUID quiz from all its saved Solutions.
+    Return number of Solutions.
+    """
+    totals = {}
+    scores = {}
+    uuids, cursor = await indexed_page("quiz_solutions", quiz, READ_CHUNK)
+    while uuids:
+        for solution in await read_many_by_uuid("solution", uuids, Solution):
+            for field, increment in solution_stats(solution).items():
+                totals[field] = totals.get(field, 0) + increment
+            scores[solution.user] = solution.score
+        uuids, cursor = cursor and await indexed_page("quiz_solutions", quiz, READ_CHUNK, cursor) or ([], "")
+    stats_key, leaderboard_key = key("stats", quiz), key("leaderboard", quiz)
+    pipe = transaction()
+    pipe.delete(stats_key, leaderboard_key)
+    if totals:
+        pipe.hset(stats_key, mapping=totals)
+        pipe.zadd(leaderboard_key, scores)
+    await pipe.execute()
+    return totals.get("count", 0)
+
+
+
+async def quiz_leaderboard(quiz: str, limit: int, offset: int = 0):
+    """
+    Return page of LeaderboardEntry for UUID quiz from highest score, starting at offset, in O(log N + limit).
+    Equal scores share the same rank, one more than the number of higher scores.
+    """
+    leaderboard_key = key("leaderboard", quiz)
+    entries = await redis.zrevrange(leaderboard_key, offset, offset + limit - 1, withscores=True)
+    leaderboard = []
+    for position, (user, score) in enumerate(entries, offset + 1):
+        if leaderboard and leaderboard[-1].score == score:
+            rank = leaderboard[-1].rank
+        elif leaderboard:
+            rank = position
+        else:
+            rank = await redis.zcount(leaderboard_key, "({}".format(score), "+inf") + 1
+        leaderboard.append(LeaderboardEntry(rank=rank, user=user.decode('utf-8'), score=score))
+    return leaderboard
+
+
+async def quiz_rank(quiz: str, user: str):
+    """Return QuizRank of UUID user on UUID quiz leaderboard in O(log N), or None if user has no Solution."""
+    leaderboard_key = key("leaderboard", quiz)
+    score = await redis.zscore(leaderboard_key, user)
+    if score is None:
+        return None
+    pipe = transaction()
+    pipe.zcount(leaderboard_key, "({}".format(score), "+inf")
+    pipe.zcount(leaderboard_key, "-inf", "({}".format(score))
+    pipe.zcard(leaderboard_key)
+    higher, lower, count = await pipe.execute()
+    return QuizRank(quiz=quiz, user=user, score=score, rank=higher + 1, count=count, percentile=100 * lower / count)
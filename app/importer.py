@@ -0,0 +1,60 @@
+"""
+Bulk import of new Questions and Quizzes for one owner, used by the import endpoint and ``manage.py import``.
+Each record is validated with the same rules as creating it through the API, and valid records are saved
+together in pipelined chunks. A result is returned for every record, so invalid records do not stop the import.
+"""
+from fastapi import HTTPException, status
+
+from storage import import_questions_quizzes
+from models import Import, ImportResult, Quiz
+from validation import validate_question, validate_quiz
+
+
+def fail(result: ImportResult, error: HTTPException, prefix: str = ""):
+    result.status_code, result.detail = error.status_code, prefix + error.detail
+
+
+async def import_document(owner: str, document: Import):
+    """Import document Questions and Quizzes for UUID owner, returning a result per Question then per Quiz."""
+    results, questions, quizzes = [], [], []
+    for index, question in enumerate(document.questions):
+        result = ImportResult(kind="question", index=index)
+        results.append(result)
+        try:
+            validate_question(question, new=True)
+        except HTTPException as error:
+            fail(result, error)
+            continue
+        question.owner = owner
+        questions.append((result, question))
+
+    for index, quiz_import in enumerate(document.quizzes):
+        result = ImportResult(kind="quiz", index=index)
+        results.append(result)
+        quiz = Quiz(owner=owner, title=quiz_import.title, published=quiz_import.published,
+                    questions=[""] * len(quiz_import.questions))
+        try:
+            validate_quiz(quiz, new=True)
+            if quiz.published and not quiz.questions:
+                raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                                    detail="Cannot publish Quiz with no questions")
+        except HTTPException as error:
+            fail(result, error)
+            continue
+        for number, question in enumerate(quiz_import.questions):
+            try:
+                validate_question(question, new=True)
+            except HTTPException as error:
+                fail(result, error, "Question {}: ".format(number))
+                break
+            question.owner = owner
+        else:
+            quizzes.append((result, quiz, quiz_import.questions))
+
+    await import_questions_quizzes([question for _, question in questions],
+                                   [(quiz, quiz_questions) for _, quiz, quiz_questions in quizzes])
+    for result, question in questions:
+        result.uuid = question.uuid
+    for result, quiz, _ in quizzes:
+        result.uuid = quiz.uuid
+    return results
@@ -5,18 +5,38 @@ To run with uvicorn use::
 
     uvicorn main:app --reload
 """
-from typing import List
-from fastapi import FastAPI, Depends, HTTPException, status
+import io
+import csv
+import hashlib
+from typing import Any, List
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordRequestForm
-
-from auth import authenticate_user, create_access_token, get_current_active_user, create_new_user
-from models import User, UserNew, Token, Question, Quiz, Solution, SolutionRec
-from db import read_question, save_question, remove_question, is_published_question, user_questions
-from db import read_quiz, save_quiz, remove_quiz, user_quizzes
-from db import exists_solution, read_solution, save_solution, user_solutions, quiz_solutions
+from pydantic import ValidationError
+
+import cache
+import codec
+import metrics
+from auth import authenticate_user, create_user_access_token, get_current_active_user, create_new_user
+from models import User, UserNew, Token, Question, Quiz, Solution, SolutionRec, SolutionResult, QuizStats
+from models import LeaderboardEntry, QuizRank, Import, ImportResult, CacheSettings
+from scoring import score_quiz, score_quiz_batch
+from validation import validate_question, validate_quiz
+from importer import import_document
+import storage
+from storage import read_question_data, save_question, remove_question, is_published_question, user_questions
+from storage import read_quiz, read_quiz_data, save_quiz, remove_quiz, user_quizzes, read_compiled_quiz, quiz_stats
+from storage import quiz_leaderboard, quiz_rank, iter_quiz_solutions
+from storage import read_solution_data, save_solution, save_solutions, user_solutions, quiz_solutions
 
 
 API = "/api/v1"
+PAGE_LIMIT = 100  # Default number of items returned per page of a collection
+PAGE_MAX = 1000  # Largest page of a collection a client can request
+BATCH_MAX = 1000  # Most solutions a client can submit in one batch
+IMPORT_MAX = 5000  # Most questions, including those of quizzes, and quizzes a client can import at once
+REVALIDATE = "private, no-cache"  # Clients may keep records but check their ETag is current before each use
+PUBLISHED = "private, max-age={}, immutable".format(CacheSettings().published_max_age)
 app = FastAPI(
     title="Example FastAPI Quizzes Project",
     description=__doc__,
@@ -26,6 +46,19 @@ app = FastAPI(
         "url": "https://www.linkedin.com/in/anilsgulati/",
     },
 )
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+@app.on_event("startup")
+async def start_storage():
+    """Start storage backend, e.g. queueing updates of solutions claimed but not yet applied when a worker stopped."""
+    await storage.start()
+
+
+@app.on_event("shutdown")
+async def stop_storage():
+    """Stop storage backend, e.g. applying updates of all solutions claimed by this worker."""
+    await storage.stop()
 
 
 @app.get(API + "/")
@@ -34,17 +67,29 @@ async def get_introduction():
     return {"introduction": "Quizzes on <b>FastAPI</b>"}
 
 
+@app.get("/caches")
+async def get_cache_stats():
+    """Unauthenticated hit, miss and eviction counters for this worker's in-process caches, for sizing."""
+    return cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Unauthenticated request, Redis, phase timing and cache metrics for this worker in Prometheus text format."""
+    return metrics.expose()
+
+
 @app.post("/token", response_model=Token)
 async def get_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
     """oAuth2 compliant authentication end point can be hosted separately if required."""
-    user = authenticate_user(form_data.username, form_data.password)
+    user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": form_data.username})
+    access_token = await create_user_access_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
@@ -61,42 +106,86 @@ async def create_user(user: UserNew):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="User name, email and password required")
     user.active = 1
     user.email = user.email.lower()
-    user = create_new_user(user.dict())
+    user = await create_new_user(user.dict())
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already in use")
     return user
 
 
 
+async def paginate(response: Response, lister, *args, limit: int, cursor: str):
+    """Return page of items from db lister, setting X-Next-Cursor response header when more pages follow."""
+    try:
+        items, next_cursor = await lister(*args, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
+
+
+def etag(data: bytes, published: bool = False):
+    """
+    Return strong entity tag of stored record bytes, changing whenever the record does.
+    Tags of published records are marked, so a matching tag gives their Cache-Control without decoding them.
+    """
+    return '"{}{}"'.format(published and "p-" or "", hashlib.blake2b(data, digest_size=16).hexdigest())
+
+
+def matching_etag(request: Request, tags: tuple):
+    """Return the first of entity tags listed in If-None-Match request header, strong or weak, else None."""
+    header = request.headers.get("if-none-match")
+    listed = header and [value.strip() for value in header.split(",")] or []
+    return next((tag for tag in tags if tag in listed or "W/" + tag in listed), None)
+
+
+def not_modified(request: Request, tag: str):
+    """Return True if If-None-Match request header matches entity tag, so the client's copy is current."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [value.strip() for value in header.split(",")]
+    return "*" in tags or tag in tags or "W/" + tag in tags
+
+
+def json_response(body: bytes, headers: dict = None):
+    """Return JSON response body as it is, bypassing response_model validation and serialisation."""
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @app.get(API + "/questions", response_model=List[Question])
-async def get_user_questions(user: User = Depends(get_current_active_user)):
-    """Get list of Question owned by authenticated user."""
-    return user_questions(user.uuid)
+async def get_user_questions(
+    response: Response,
+    limit: int = Query(PAGE_LIMIT, ge=1, le=PAGE_MAX),
+    cursor: str = "",
+    user: User = Depends(get_current_active_user),
+):
+    """Get page of Questions owned by authenticated user in creation order. Pass X-Next-Cursor as cursor for more."""
+    return await paginate(response, user_questions, user.uuid, limit=limit, cursor=cursor)
 
 
 @app.get(API + "/questions/{uuid}", response_model=Question)
-async def get_question(uuid: str, user: User = Depends(get_current_active_user)):
-    """Get specified individual Question."""
+async def get_question(uuid: str, request: Request, user: User = Depends(get_current_active_user)):
+    """Get specified individual Question with its ETag, or 304 Not Modified if the client's copy is current."""
     if uuid.split("-", 1)[0] != user.uuid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Only read your own Questions")
-    question = read_question(uuid)
-    if not question:
+    data = await read_question_data(uuid)
+    if not data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Question not found")
-    return question
+    headers = {"ETag": etag(data), "Cache-Control": REVALIDATE}  # Unpublished Questions can change
+    if not_modified(request, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    body, _ = codec.response_json(data, Question)
+    return json_response(body, headers)
 
 
 @app.post(API + "/questions", response_model=Question)
 async def create_question(question: Question, user: User = Depends(get_current_active_user)):
     """Create new Question."""
-    if not question.text:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Question text is required")
-    if not (len(question.answers) <= 5 or len(question.correct) <= 5):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Question cannot have more than 5 answers")
-    if question.correct and not any(question.correct):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Question must have a correct answer")
+    validate_question(question, new=True)
     question.uuid = ""
     question.owner = user.uuid
-    question = save_question(question)
+    question = await save_question(question)
     if not question:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Question not created")
     return question
@@ -107,15 +196,12 @@ async def update_question(uuid: str, question: Question, user: User = Depends(ge
     """Update specified Question if not yet published."""
     if uuid.split("-", 1)[0] != user.uuid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Only edit your own Questions")
-    if is_published_question(uuid) is True:
+    if await is_published_question(uuid) is True:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot update published Questions")
-    if not (len(question.answers) <= 5 or len(question.correct) <= 5):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Question cannot have more than 5 answers")
-    if question.correct and not any(question.correct):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Question must have a correct answer")
+    validate_question(question)
     question.uuid = uuid
     question.owner = user.uuid
-    question = save_question(question)
+    question = await save_question(question)
     if not question:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Question not found")
     return question
@@ -125,9 +211,9 @@ async def update_question(uuid: str, question: Question, user: User = Depends(ge
 async def delete_question(uuid: str, user: User = Depends(get_current_active_user)):
     if uuid.split("-", 1)[0] != user.uuid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Only delete your own Questions")
-    if is_published_question(uuid) is not None:
+    if await is_published_question(uuid) is not None:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot delete Questions in use")
-    question = remove_question(uuid)
+    question = await remove_question(uuid)
     if not question:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Question not found")
     return question
@@ -135,40 +221,156 @@ async def delete_question(uuid: str, user: User = Depends(get_current_active_use
 
 
 @app.get(API + "/quizzes", response_model=List[Quiz])
-async def get_user_quizzes(user: User = Depends(get_current_active_user)):
-    """Get list of Quizzes owned by authenticated user."""
-    return user_quizzes(user.uuid)
+async def get_user_quizzes(
+    response: Response,
+    limit: int = Query(PAGE_LIMIT, ge=1, le=PAGE_MAX),
+    cursor: str = "",
+    user: User = Depends(get_current_active_user),
+):
+    """Get page of Quizzes owned by authenticated user in creation order. Pass X-Next-Cursor as cursor for more."""
+    return await paginate(response, user_quizzes, user.uuid, limit=limit, cursor=cursor)
 
 
 @app.get(API + "/quizzes/{uuid}/solutions", response_model=List[Solution])
-async def get_quiz_solutions(uuid: str, user: User = Depends(get_current_active_user)):
-    """Return all Solutions recorded for specified individual Quiz owned by authenticated user."""
+async def get_quiz_solutions(
+    uuid: str,
+    response: Response,
+    limit: int = Query(PAGE_LIMIT, ge=1, le=PAGE_MAX),
+    cursor: str = "",
+    user: User = Depends(get_current_active_user),
+):
+    """Return page of Solutions recorded for specified individual Quiz owned by authenticated user."""
+    if uuid.split("-", 1)[0] != user.uuid:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Only view your own Quizzes")
+    return await paginate(response, quiz_solutions, user.uuid, uuid, limit=limit, cursor=cursor)
+
+
+async def export_ndjson(chunks):
+    """Yield chunks of Solutions as newline delimited JSON."""
+    async for solutions in chunks:
+        yield "".join(solution.json() + "\n" for solution in solutions)
+
+
+def csv_header(questions: int):
+    """Return CSV header row of a Solution export, with a score column per question."""
+    columns = ["uuid", "user", "quiz", "title", "score"]
+    columns.extend("question_{}".format(number + 1) for number in range(questions))
+    rows = io.StringIO()
+    csv.writer(rows).writerow(columns)
+    return rows.getvalue()
+
+
+async def export_csv(chunks, questions: int = 0):
+    """
+    Yield header row then chunks of Solutions as CSV rows, with a score column per question of the quiz.
+    The header is always sent, even without Solutions. Questions of a deleted quiz are counted from its Solutions.
+    """
+    header = True
+    async for solutions in chunks:
+        rows = io.StringIO()
+        if header:
+            rows.write(csv_header(questions or len(solutions[0].scores)))
+            header = False
+        writer = csv.writer(rows)
+        for solution in solutions:
+            row = [solution.uuid, solution.user, solution.quiz, solution.title, solution.score]
+            writer.writerow(row + solution.scores)
+        yield rows.getvalue()
+    if header:
+        yield csv_header(questions)
+
+
+@app.get(API + "/quizzes/{uuid}/solutions/export")
+async def export_quiz_solutions(
+    uuid: str,
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    user: User = Depends(get_current_active_user),
+):
+    """
+    Stream all Solutions recorded for specified Quiz owned by authenticated user as NDJSON or CSV.
+    Solutions are read from Redis a chunk at a time only as the client consumes the response,
+    so memory stays bounded regardless of the number of Solutions.
+    """
     if uuid.split("-", 1)[0] != user.uuid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Only view your own Quizzes")
-    return quiz_solutions(user.uuid, uuid)
+    chunks = iter_quiz_solutions(user.uuid, uuid)
+    if format == "csv":
+        quiz = await read_quiz(uuid)
+        media_type, content = "text/csv", export_csv(chunks, quiz and len(quiz.questions) or 0)
+    else:
+        media_type, content = "application/x-ndjson", export_ndjson(chunks)
+    filename = "{}-solutions.{}".format(uuid, format)
+    headers = {"Content-Disposition": 'attachment; filename="{}"'.format(filename)}
+    return StreamingResponse(content, media_type=media_type, headers=headers)
 
 
-@app.get(API + "/quizzes/{uuid}", response_model=Quiz)
-async def get_quiz(uuid: str, user: User = Depends(get_current_active_user)):
-    """Return specified individual Quiz."""
+@app.get(API + "/quizzes/{uuid}/stats", response_model=QuizStats)
+async def get_quiz_stats(uuid: str, user: User = Depends(get_current_active_user)):
+    """Return running statistics of all Solutions recorded for specified Quiz owned by authenticated user."""
     if uuid.split("-", 1)[0] != user.uuid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Only view your own Quizzes")
-    quiz = read_quiz(uuid)
+    return await quiz_stats(uuid)
+
+
+@app.get(API + "/quizzes/{uuid}/leaderboard", response_model=List[LeaderboardEntry])
+async def get_quiz_leaderboard(
+    uuid: str,
+    limit: int = Query(20, ge=1, le=PAGE_MAX),
+    offset: int = Query(0, ge=0),
+    user: User = Depends(get_current_active_user),
+):
+    """
+    Return page of top scores recorded for specified Quiz, highest first. Use offset for following pages.
+    Leaderboards of published Quizzes are public, others only visible to their owner.
+    """
+    quiz = await read_quiz(uuid)
     if not quiz:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Quiz not found")
-    return quiz
+    if not quiz.published and quiz.owner != user.uuid:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Only view your own unpublished Quizzes")
+    return await quiz_leaderboard(uuid, limit, offset)
+
+
+@app.get(API + "/quizzes/{uuid}/rank", response_model=QuizRank)
+async def get_quiz_rank(uuid: str, user: User = Depends(get_current_active_user)):
+    """Return authenticated user's rank and percentile on specified Quiz."""
+    rank = await quiz_rank(uuid, user.uuid)
+    if not rank:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Solution not found")
+    return rank
+
+
+@app.get(API + "/quizzes/{uuid}", response_model=Quiz)
+async def get_quiz(uuid: str, request: Request, user: User = Depends(get_current_active_user)):
+    """
+    Return specified individual Quiz with its ETag, or 304 Not Modified if the client's copy is current.
+    Published Quizzes never change, so clients may reuse them for PUBLISHED_MAX_AGE without checking.
+    """
+    if uuid.split("-", 1)[0] != user.uuid:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Only view your own Quizzes")
+    data = await read_quiz_data(uuid)
+    if not data:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Quiz not found")
+    published, draft = etag(data, published=True), etag(data)
+    tag = matching_etag(request, (published, draft))  # Issued for these same bytes, so its mark is current
+    if tag:
+        headers = {"ETag": tag, "Cache-Control": tag == published and PUBLISHED or REVALIDATE}
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    body, values = codec.response_json(data, Quiz)  # Only decoded to send the Quiz
+    headers = values["published"] and {"ETag": published, "Cache-Control": PUBLISHED} or {
+        "ETag": draft, "Cache-Control": REVALIDATE}
+    if not_modified(request, headers["ETag"]):  # If-None-Match: *
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return json_response(body, headers)
 
 
 @app.post(API + "/quizzes", response_model=Quiz)
 async def create_quiz(quiz: Quiz, user: User = Depends(get_current_active_user)):
     """Create new Quiz."""
-    if not quiz.title:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Quiz title is required")
-    if len(quiz.questions) > 10:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Quiz cannot have more than 10 questions")
+    validate_quiz(quiz, new=True)
     quiz.uuid = ""
     quiz.owner = user.uuid
-    quiz = save_quiz(quiz)
+    quiz = await save_quiz(quiz)
     if not quiz:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Quiz not created")
     return quiz
@@ -179,18 +381,17 @@ async def update_quiz(uuid: str, quiz: Quiz, user: User = Depends(get_current_ac
     """Update unpublished Quiz."""
     if uuid.split("-", 1)[0] != user.uuid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Only edit your own Quizzes")
-    old_quiz = read_quiz(uuid)
+    old_quiz = await read_quiz(uuid)
     if not old_quiz:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Quiz not found")
     if old_quiz.published:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot update published Quiz")
-    if len(quiz.questions) > 10:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Quiz cannot have more than 10 questions")
+    validate_quiz(quiz)
     if quiz.published and not (old_quiz.questions or quiz.questions):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot publish Quiz with no questions")
     quiz.uuid = uuid
     quiz.owner = user.uuid
-    quiz = save_quiz(quiz)
+    quiz = await save_quiz(quiz)
     if not quiz:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Quiz not updated")
     return quiz
@@ -201,71 +402,49 @@ async def delete_quiz(uuid: str, user: User = Depends(get_current_active_user)):
     """Delete quiz and remove tracking for associated questions."""
     if uuid.split("-", 1)[0] != user.uuid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Only delete your own Quizzes")
-    quiz = remove_quiz(uuid)
+    quiz = await remove_quiz(uuid)
     if not quiz:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Quiz not found")
     return quiz
 
 
-
-def score_single_answer_question(uuid: str, correct: List[bool], answers: List[bool]):
-    """Return question score scaled x 1,000 for question requiring only one answer."""
-    if sum(answers) == 0:
-        return 0  # Skipped question
-    if sum(answers) > 1:
-        detail = "Multiple answers for single answer question '{}'".format(uuid)
+@app.post(API + "/import", response_model=List[ImportResult])
+async def import_questions_quizzes(document: Import, user: User = Depends(get_current_active_user)):
+    """
+    Create many new Questions, and Quizzes given with their new Questions in full, in one request.
+    Records are validated as when created individually, and saved together in pipelined batches.
+    Returns a result per Question then per Quiz in document order, each with its new UUID or its error.
+    """
+    count = len(document.questions) + sum(len(quiz.questions) + 1 for quiz in document.quizzes)
+    if count > IMPORT_MAX:
+        detail = "Import cannot have more than {} questions and quizzes".format(IMPORT_MAX)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
-    return answers[correct.index(True)] and 1000 or -1000
-
-
-def score_multi_answer_question(uuid: str, correct: List[bool], answers: List[bool]):
-    """Return question score scaled x 1,000 for question allowing multiple answers."""
-    if sum(answers) == 0:
-        return 0  # Skipped question
-    right = sum(correct)
-    wrong = len(correct) - right
-    right, wrong = 1000 / right, -1000 / wrong
-    return sum(q and right or wrong for q, a in zip(correct, answers) if a)
-
-
-def score_question(uuid: str, correct: List[bool], answers: List[bool]):
-    """Return question score scaled x 1,000 for any question."""
-    if sum(correct) == 1:
-        return score_single_answer_question(uuid, correct, answers)
-    else:
-        return score_multi_answer_question(uuid, correct, answers)
-
-
-def score_quiz(quiz: Quiz, solution: SolutionRec):
-    """Return scored Quiz as updated SolutionRec given Quiz and SolutionRec."""
-    solution.title = quiz.title
-    solution.questions = []
-    solution.scores = []
-    solution.score = 0
+    return await import_document(user.uuid, document)
 
-    for question, answers in zip(quiz.questions, solution.answers):  # (Question UUID, List[bool])
-        question = read_question(question)  # Convert Question UUID to Question instance
-        if not question:
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Quiz Question missing")
-        solution.questions.append(question.text)
 
-        if len(question.correct) != len(answers):
-            detail = "Wrong number of answers for question '{}'".format(question.uuid)
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
-
-        score = score_question(question.uuid, question.correct, answers)  # Score x 1,000
-        solution.score += score  # Score x 1,000
-        solution.scores.append(round(score / 10))  # Score x 100 percentage
-
-    solution.score = round((solution.score / len(solution.scores)) / 10)  # Overall quiz average question percentage
-    return solution
 
+async def read_published_quiz(uuid: str):
+    """Return CompiledQuiz for published Quiz that can be taken, or raise error explaining why it cannot."""
+    quiz = await read_compiled_quiz(uuid)
+    if not quiz:
+        unpublished_quiz = await read_quiz(uuid)
+        if not unpublished_quiz:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Quiz not found")
+        if not unpublished_quiz.published:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot take unpublished Quiz")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Quiz Question missing")
+    return quiz
 
 
 @app.get(API + "/solutions", response_model=List[Solution])
-async def get_user_solutions(user: User = Depends(get_current_active_user)):
-    """Return all Solutions recorded for current authenticated user."""
-    return user_solutions(user.uuid)
+async def get_user_solutions(
+    response: Response,
+    limit: int = Query(PAGE_LIMIT, ge=1, le=PAGE_MAX),
+    cursor: str = "",
+    user: User = Depends(get_current_active_user),
+):
+    """Return page of Solutions recorded for current authenticated user. Pass X-Next-Cursor as cursor for more."""
+    return await paginate(response, user_solutions, user.uuid, limit=limit, cursor=cursor)
 
 
 @app.get(API + "/solutions/{uuid}", response_model=Solution)
@@ -273,10 +452,11 @@ async def get_solution(uuid: str, user: User = Depends(get_current_active_user))
     """Return individual Solution. Expects full combined solution UUID of "<user>-<owner>-<quiz>"."""
     if uuid.split("-", 1)[0] != user.uuid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Only view your own Solutions")
-    solution = read_solution(uuid)
-    if not solution:
+    data = await read_solution_data(uuid)
+    if not data:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Solution not found")
-    return solution
+    body, _ = codec.response_json(data, Solution)  # Leaves out the stored answers
+    return json_response(body)
 
 
 @app.post(API + "/solutions", response_model=Solution)
@@ -284,22 +464,78 @@ async def create_solution(solution: SolutionRec, user: User = Depends(get_curren
     """Submit set of answers as a solution to a specified quiz. Returns recorded Solution."""
     if not solution.quiz:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Quiz being answered is required")
-    quiz = read_quiz(solution.quiz)
-    if not quiz:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Quiz not found")
-    if not quiz.published:
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot take unpublished Quiz")
+    quiz = await read_published_quiz(solution.quiz)
     solution.user = user.uuid
     solution.uuid = "-".join((solution.user, solution.quiz))
-    if exists_solution(solution.uuid):
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot repeat Quiz")
     if not solution.answers:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Answers are required")
     if len(solution.answers) != len(quiz.questions):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Wrong number of answers")
     solution = score_quiz(quiz, solution)
     if quiz.owner != user.uuid:  # Owners solutions respond but don't save
-        solution = save_solution(solution)
+        solution = await save_solution(solution)  # Atomic, None if already saved
     if not solution:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Solution not saved")
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Cannot repeat Quiz")
     return solution
+
+
+@app.post(API + "/solutions/batch", response_model=List[SolutionResult])
+async def create_solutions(submissions: List[Any], user: User = Depends(get_current_active_user)):
+    """
+    Submit many sets of answers, possibly to different quizzes, e.g. when syncing offline devices.
+    Each submission is a SolutionRec, validated separately so a malformed one only fails its own result with 422.
+    Submissions are grouped by quiz, scored together, and saved in pipelined batches.
+    Returns a result per submission in submission order, each with its recorded Solution or its error.
+    """
+    if len(submissions) > BATCH_MAX:
+        detail = "Batch cannot have more than {} solutions".format(BATCH_MAX)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+    results = [SolutionResult(index=index) for index in range(len(submissions))]
+    solutions = [None] * len(submissions)
+    by_quiz = {}
+    for index, submission in enumerate(submissions):
+        try:
+            solution = solutions[index] = SolutionRec.parse_obj(submission)
+        except ValidationError as error:
+            results[index].status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+            results[index].detail = "; ".join("{}: {}".format(".".join(map(str, item["loc"])), item["msg"])
+                                              for item in error.errors())
+            continue
+        if solution.quiz:
+            by_quiz.setdefault(solution.quiz, []).append(index)
+        else:
+            results[index].status_code = status.HTTP_400_BAD_REQUEST
+            results[index].detail = "Quiz being answered is required"
+
+    unsaved = []  # Indexes of scored solutions to save
+    for uuid, indexes in by_quiz.items():
+        try:
+            quiz = await read_published_quiz(uuid)
+        except HTTPException as error:
+            for index in indexes:
+                results[index].status_code, results[index].detail = error.status_code, error.detail
+            continue
+        scores, totals, errors = score_quiz_batch(quiz, [solutions[index].answers for index in indexes])
+        for row, index in enumerate(indexes):
+            if errors[row]:
+                results[index].status_code, results[index].detail = errors[row].status_code, errors[row].detail
+                continue
+            solution = solutions[index]
+            solution.user = user.uuid
+            solution.uuid = "-".join((solution.user, solution.quiz))
+            solution.title = quiz.title
+            solution.questions = quiz.texts
+            solution.scores = scores[row].tolist()
+            solution.score = int(totals[row])
+            if quiz.owner != user.uuid:  # Owners solutions respond but don't save
+                unsaved.append(index)
+            else:
+                results[index].solution = solution
+
+    saved = await save_solutions([solutions[index] for index in unsaved])
+    for index, solution in zip(unsaved, saved):
+        if solution:
+            results[index].solution = solution
+        else:
+            results[index].status_code, results[index].detail = status.HTTP_403_FORBIDDEN, "Cannot repeat Quiz"
+    return results
@@ -0,0 +1,183 @@
+"""
+Management commands for maintaining the Redis data store, run from the app directory::
+
+    python manage.py index
+    python manage.py deactivate someone@example.com
+    python manage.py revoke someone@example.com
+    python manage.py pending
+    python manage.py stats  # Or give quiz UUIDs
+    python manage.py import someone@example.com questions.json
+    python manage.py rekey --replace  # Or --delete, see rekey
+
+Commands use the same environment settings as the application.
+"""
+import sys
+import json
+import time
+import argparse
+import asyncio
+import db
+from models import Import
+from importer import import_document
+
+
+async def build_indexes():
+    """
+    Build sorted set indexes for existing Questions, Quizzes and Solutions. Safe to run repeatedly.
+    Index entries are added in pipelines of REDIS_WRITE_CHUNK commands.
+    """
+    counts = {"question": 0, "quiz": 0, "solution": 0}
+    pipe = db.redis.pipeline(transaction=False)
+
+    def index(name: str, owner: str, uuid: str):
+        pipe.zadd(db.key(name, owner), {uuid: time.time()}, nx=True)  # Keep the original time if present
+
+    async def flush(size: int = 1):
+        if len(pipe) >= size:
+            await pipe.execute()
+
+    for prefix in counts:
+        async for key in db.redis.scan_iter(match=db.key_pattern(prefix), count=db.WRITE_CHUNK):
+            uuid = db.key_uuid(key.decode('utf-8'))
+            owner = uuid.split("-", 1)[0]
+            if prefix == "solution":
+                index("solutions", owner, uuid)
+                index("quiz_solutions", uuid.split("-", 1)[1], uuid)
+            else:
+                index(prefix == "quiz" and "quizzes" or "questions", owner, uuid)
+            counts[prefix] += 1
+            await flush(db.WRITE_CHUNK)
+    await flush()
+    return counts
+
+
+async def rebuild_stats(quizzes: list):
+    """Recompute running statistics for given quiz UUIDs, or every quiz with solutions, printing counts."""
+    if not quizzes:
+        pattern = db.key_pattern("quiz_solutions")
+        quizzes = [db.key_uuid(key.decode('utf-8')) async for key in db.redis.scan_iter(match=pattern)]
+    for quiz in quizzes:
+        print("Rebuilt {} statistics from {} solutions".format(quiz, await db.rebuild_quiz_stats(quiz)))
+
+
+REKEY_PREFIXES = ("user", "question", "questions", "quiz", "quizzes", "compiled", "published", "unpublished",
+                  "solution", "solutions", "quiz_solutions", "stats", "leaderboard")
+
+
+async def copy_keys(pairs: list, replace: bool, delete: bool):
+    """Copy values and expiry of old to new keys in pairs, returning counts of keys copied and skipped."""
+    pipe = db.redis.pipeline(transaction=False)
+    for old, _ in pairs:
+        pipe.dump(old)
+        pipe.pttl(old)
+    results = await pipe.execute()
+    for (old, new), data, ttl in zip(pairs, results[::2], results[1::2]):
+        if data is not None:  # Skip keys removed meanwhile
+            pipe.restore(new, max(ttl, 0), data, replace=replace)
+    results = await pipe.execute(raise_on_error=False)
+    copied = skipped = 0
+    for result in results:
+        if isinstance(result, Exception):
+            if "BUSYKEY" not in str(result):
+                raise result
+            skipped += 1
+        else:
+            copied += 1
+    if delete:
+        await db.redis.unlink(*[old for old, _ in pairs])
+    return copied, skipped
+
+
+async def rekey(replace: bool = False, delete: bool = False):
+    """
+    Copy every version 1 key to its version 2 key with DUMP and RESTORE, while the application keeps serving.
+    Existing version 2 keys are kept, unless replace, and version 1 keys are removed once copied with delete:
+
+    1. Run ``rekey --replace`` while workers use key version 1.
+    2. Switch workers to REDIS_KEY_VERSION=2.
+    3. Run ``rekey --delete`` to copy keys created in between and remove version 1 keys.
+    4. Run ``index`` and ``stats`` to rebuild indexes, statistics and leaderboards updated in between.
+
+    Pending solution lists are not copied, their solutions are indexed and counted by step 4.
+    """
+    for prefix in REKEY_PREFIXES:
+        pairs, copied, skipped = [], 0, 0
+        async for key in db.redis.scan_iter(match=db.key_pattern(prefix, 1), count=db.WRITE_CHUNK):
+            key = key.decode('utf-8')
+            pairs.append((key, db.key(prefix, db.key_uuid(key, 1), 2)))
+            if len(pairs) >= db.WRITE_CHUNK:
+                counts = await copy_keys(pairs, replace, delete)
+                copied, skipped, pairs = copied + counts[0], skipped + counts[1], []
+        if pairs:
+            counts = await copy_keys(pairs, replace, delete)
+            copied, skipped = copied + counts[0], skipped + counts[1]
+        print("Copied {} {} keys, kept {} existing".format(copied, prefix, skipped))
+    if await db.redis.exists("revoked"):
+        copied, skipped = await copy_keys([("revoked", "v2:revoked")], replace, delete)
+        print("Copied {} revoked keys, kept {} existing".format(copied, skipped))
+
+
+async def import_file(email: str, path: str):
+    """Import document of Questions and Quizzes from JSON file for user with email, printing any failures."""
+    user = await db.get_user(email)
+    if not user:
+        print("User not found")
+        return 1
+    with open(path) as file:
+        document = Import.parse_obj(json.load(file))
+    results = await import_document(user.uuid, document)
+    imported = {"question": 0, "quiz": 0}
+    for result in results:
+        if result.status_code == 200:
+            imported[result.kind] += 1
+        else:
+            print("{} {} failed {}: {}".format(result.kind, result.index, result.status_code, result.detail))
+    print("Imported {} questions and {} quizzes".format(imported["question"], imported["quiz"]))
+    return len(results) != sum(imported.values()) and 1 or 0
+
+
+async def apply_pending():
+    """Apply updates of solutions claimed with write behind but left pending, e.g. by a stopped worker."""
+    print("Applying {} pending solutions".format(await db.solution_writer.recover()))
+    await db.solution_writer.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("index", help="Build owner, user and quiz indexes from existing data")
+    deactivate = commands.add_parser("deactivate", help="Mark user inactive")
+    deactivate.add_argument("email")
+    revoke = commands.add_parser("revoke", help="Revoke all access tokens issued to user so far")
+    revoke.add_argument("email")
+    commands.add_parser("pending", help="Apply updates of solutions left pending by write behind")
+    stats = commands.add_parser("stats", help="Rebuild running quiz statistics from saved solutions")
+    stats.add_argument("quizzes", nargs="*", help="Quiz UUIDs, all quizzes with solutions if none given")
+    load = commands.add_parser("import", help="Import questions and quizzes from a JSON document for a user")
+    load.add_argument("email")
+    load.add_argument("path", help='JSON document as posted to /api/v1/import: {"questions": [], "quizzes": []}')
+    copy = commands.add_parser("rekey", help="Copy keys to the hash tagged key version 2 layout")
+    copy.add_argument("--replace", action="store_true", help="Overwrite existing version 2 keys")
+    copy.add_argument("--delete", action="store_true", help="Remove version 1 keys once copied")
+    args = parser.parse_args()
+    if args.command == "index":
+        for prefix, count in asyncio.run(build_indexes()).items():
+            print("Indexed {} {} records".format(count, prefix))
+    elif args.command == "deactivate":
+        user = asyncio.run(db.deactivate_user(args.email.lower()))
+        print(user and "Deactivated {}".format(user.email) or "User not found")
+    elif args.command == "revoke":
+        user = asyncio.run(db.revoke_user_tokens(args.email.lower()))
+        print(user and "Revoked tokens of {}".format(user.email) or "User not found")
+    elif args.command == "stats":
+        asyncio.run(rebuild_stats(args.quizzes))
+    elif args.command == "pending":
+        asyncio.run(apply_pending())
+    elif args.command == "import":
+        return asyncio.run(import_file(args.email.lower(), args.path))
+    elif args.command == "rekey":
+        asyncio.run(rekey(args.replace, args.delete))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,391 @@
+"""
+In-process storage backend holding everything in dicts and sorted lists, implementing the Storage protocol.
+For a single worker where data need not outlive the process, e.g. tests, demonstrations and benchmarks.
+Records are stored encoded as JSON, as in Redis, so callers never share stored instances.
+Indexes and leaderboards are sorted lists ordered as Redis sorted sets, giving the same pages and ranks.
+Each operation completes without awaiting, so is atomic on the event loop like the Redis scripts and transactions.
+"""
+import time
+from bisect import bisect_left, bisect_right, insort
+
+import shortuuid
+
+import codec
+from models import UserRec, Question, Quiz, Solution, SolutionRec
+from models import LeaderboardEntry, QuizRank
+from records import update_question, update_quiz, compiled_quiz, encode_cursor, decode_cursor, solution_stats
+import records
+
+
+encoder = codec.get_codec("json")
+PAGE_CHUNK = 500  # Solutions per chunk when iterating
+HIGHEST = "\U0010ffff"  # Sorts after every member, for counting members up to a score
+
+
+class SortedIndex:
+    """Sorted set of members by score, ordered by score then member as in Redis."""
+
+    def __init__(self):
+        self.scores = {}  # member: score
+        self.entries = []  # (score, member) in order
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, member: str, score: float, nx: bool = False):
+        """Add member with score, or update its score unless nx."""
+        old = self.scores.get(member)
+        if old is not None:
+            if nx:
+                return
+            del self.entries[bisect_left(self.entries, (old, member))]
+        self.scores[member] = score
+        insort(self.entries, (score, member))
+
+    def remove(self, member: str):
+        score = self.scores.pop(member, None)
+        if score is not None:
+            del self.entries[bisect_left(self.entries, (score, member))]
+
+    def rank(self, member: str):
+        """Return position of member from lowest score, or None if absent."""
+        score = self.scores.get(member)
+        return None if score is None else bisect_left(self.entries, (score, member))
+
+    def count_upto(self, score: float):
+        """Return number of members with score up to and including score."""
+        return bisect_right(self.entries, (score, HIGHEST))
+
+    def count_below(self, score: float):
+        """Return number of members with score below score."""
+        return bisect_left(self.entries, (score,))
+
+
+users = {}  # email: UserRec
+revoked = {}  # User UUID: token generation
+records_by_key = {}  # (prefix, UUID): encoded record
+compiled_quizzes = {}  # Quiz UUID: CompiledQuiz of published quiz, never modified
+indexes = {}  # (index, owner): SortedIndex of UUIDs by creation time
+published = {}  # Question UUID: set of published quiz UUIDs using it
+unpublished = {}  # Question UUID: set of unpublished quiz UUIDs using it
+stats = {}  # Quiz UUID: running statistics fields
+leaderboards = {}  # Quiz UUID: SortedIndex of user UUIDs by score
+
+
+def clear():
+    """Remove all data, e.g. between tests."""
+    for data in (users, revoked, records_by_key, compiled_quizzes, indexes, published, unpublished, stats,
+                 leaderboards):
+        data.clear()
+
+
+async def start():
+    pass
+
+
+async def stop():
+    pass
+
+
+async def get_user(username: str):
+    user = users.get(username)
+    return user and user.copy()
+
+
+async def get_cached_user(username: str):
+    return await get_user(username)
+
+
+async def save_user(user: dict):
+    """Create new User."""
+    user = UserRec(**user)
+    user.uuid = shortuuid.uuid()
+    users[user.email] = user.copy()
+    return user
+
+
+async def deactivate_user(username: str):
+    """Mark existing User inactive and revoke its tokens, returning updated UserRec or None if not found."""
+    user = users.get(username)
+    if not user:
+        return None
+    user.active = 0
+    revoked[user.uuid] = revoked.get(user.uuid, 0) + 1
+    return user.copy()
+
+
+async def revoke_user_tokens(username: str):
+    """Revoke all tokens issued to existing User so far, returning UserRec or None if not found."""
+    user = users.get(username)
+    if not user:
+        return None
+    revoked[user.uuid] = revoked.get(user.uuid, 0) + 1
+    return user.copy()
+
+
+async def token_generation(uuid: str):
+    return revoked.get(uuid, 0)
+
+
+async def revoked_generations():
+    return revoked
+
+
+def read_record(prefix: str, uuid: str, model):
+    data = records_by_key.get((prefix, uuid))
+    return data and codec.decode(data, model)
+
+
+def save_record(prefix: str, index: str, instance, created: float = None):
+    """Save model instance under prefixed UUID and add it to index for its owner, keeping any earlier entry."""
+    records_by_key[(prefix, instance.uuid)] = encoder.encode(instance)
+    indexes.setdefault((index, instance.owner), SortedIndex()).add(instance.uuid, created or time.time(), nx=True)
+
+
+def remove_record(prefix: str, index: str, owner: str, uuid: str):
+    records_by_key.pop((prefix, uuid), None)
+    if (index, owner) in indexes:
+        indexes[(index, owner)].remove(uuid)
+
+
+def read_indexed(prefix: str, index: str, owner: str, model, limit: int, cursor: str = ""):
+    """Return page of model instances listed in index for owner following cursor, and cursor for next page."""
+    entries = indexes.get((index, owner), SortedIndex())
+    start = 0
+    if cursor:
+        created, uuid = decode_cursor(cursor)
+        rank = entries.rank(uuid)
+        start = rank + 1 if rank is not None else entries.count_upto(created)  # Resume after removed UUID
+    page = entries.entries[start:start + limit + 1]  # One extra entry shows more pages follow
+    next_cursor = ""
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(*page[-1])
+    instances = (read_record(prefix, uuid, model) for _, uuid in page)
+    return [instance for instance in instances if instance], next_cursor
+
+
+def set_published(uuid: str, quiz: str, state: bool = None):
+    """Record question as used in published or unpublished quiz, or with state None as no longer used in it."""
+    published.setdefault(uuid, set()).discard(quiz)
+    unpublished.setdefault(uuid, set()).discard(quiz)
+    if state is not None:
+        (state and published or unpublished)[uuid].add(quiz)
+
+
+async def is_published_question(uuid: str):
+    """Return True if question is published, False if only in unpublished quizzes, None if unused orphan."""
+    if published.get(uuid):
+        return True
+    if unpublished.get(uuid):
+        return False
+    return None
+
+
+async def read_question(uuid: str):
+    return read_record("question", uuid, Question)
+
+
+async def read_question_data(uuid: str):
+    return records_by_key.get(("question", uuid))
+
+
+async def save_question(question: Question):
+    if question.uuid:
+        old_question = await read_question(question.uuid)
+        if not old_question:
+            return None
+        update_question(question, old_question)
+    else:
+        question.uuid = "-".join((question.owner, shortuuid.uuid()))
+    save_record("question", "questions", question)
+    return question
+
+
+async def remove_question(uuid: str):
+    question = await read_question(uuid)
+    remove_record("question", "questions", uuid.split("-", 1)[0], uuid)
+    return question
+
+
+async def user_questions(owner: str, limit: int, cursor: str = ""):
+    return read_indexed("question", "questions", owner, Question, limit, cursor)
+
+
+async def read_quiz(uuid: str):
+    return read_record("quiz", uuid, Quiz)
+
+
+async def read_quiz_data(uuid: str):
+    return records_by_key.get(("quiz", uuid))
+
+
+def build_compiled_quiz(quiz: Quiz):
+    """Return CompiledQuiz snapshot of Quiz with its Questions, or None if any Question is missing."""
+    questions = [read_record("question", uuid, Question) for uuid in quiz.questions]
+    if not all(questions):
+        return None
+    return compiled_quiz(quiz, questions)
+
+
+async def save_quiz(quiz: Quiz):
+    """Create or update Quiz with its question publish states and any compiled snapshot."""
+    if quiz.uuid:
+        old_quiz = await read_quiz(quiz.uuid)
+        if not old_quiz or old_quiz.published:
+            return None
+        update_quiz(quiz, old_quiz)
+        for uuid in set(old_quiz.questions) - set(quiz.questions):
+            set_published(uuid, quiz.uuid)
+        for uuid in quiz.questions:
+            set_published(uuid, quiz.uuid, bool(quiz.published))
+        if quiz.published:
+            compiled = build_compiled_quiz(quiz)
+            if compiled:
+                compiled_quizzes[quiz.uuid] = compiled
+    else:
+        quiz.uuid = "-".join((quiz.owner, shortuuid.uuid()))
+        quiz.published = False
+        for uuid in quiz.questions:
+            set_published(uuid, quiz.uuid, False)
+    save_record("quiz", "quizzes", quiz)
+    return quiz
+
+
+async def remove_quiz(uuid: str):
+    quiz = await read_quiz(uuid)
+    if not quiz:
+        return None
+    remove_record("quiz", "quizzes", quiz.owner, uuid)
+    compiled_quizzes.pop(uuid, None)
+    for question in quiz.questions:
+        set_published(question, uuid)
+    return quiz
+
+
+async def user_quizzes(owner: str, limit: int, cursor: str = ""):
+    return read_indexed("quiz", "quizzes", owner, Quiz, limit, cursor)
+
+
+async def read_compiled_quiz(uuid: str):
+    """Return CompiledQuiz for published Quiz, compiling it on first use, or None if not published or compilable."""
+    compiled = compiled_quizzes.get(uuid)
+    if not compiled:
+        quiz = await read_quiz(uuid)
+        if quiz and quiz.published:
+            compiled = build_compiled_quiz(quiz)
+            if compiled:
+                compiled_quizzes[uuid] = compiled
+    return compiled
+
+
+async def import_questions_quizzes(questions: list, quizzes: list):
+    """Save new Questions, and new Quizzes each given as a pair of Quiz and list of its new Questions."""
+    for question in questions:
+        question.uuid = "-".join((question.owner, shortuuid.uuid()))
+        save_record("question", "questions", question)
+    for quiz, quiz_questions in quizzes:
+        quiz.uuid = "-".join((quiz.owner, shortuuid.uuid()))
+        quiz.questions = []
+        for question in quiz_questions:
+            question.uuid = "-".join((question.owner, shortuuid.uuid()))
+            quiz.questions.append(question.uuid)
+            save_record("question", "questions", question)
+            set_published(question.uuid, quiz.uuid, bool(quiz.published))
+        save_record("quiz", "quizzes", quiz)
+        if quiz.published:
+            compiled_quizzes[quiz.uuid] = compiled_quiz(quiz, quiz_questions)
+    return questions, quizzes
+
+
+async def read_solution(uuid: str):
+    return read_record("solution", uuid, Solution)
+
+
+async def read_solution_data(uuid: str):
+    return records_by_key.get(("solution", uuid))
+
+
+def update_stats(quiz: str, solution: Solution):
+    """Add Solution to running statistics and leaderboard of quiz."""
+    fields = stats.setdefault(quiz, {})
+    for field, increment in solution_stats(solution).items():
+        fields[field] = fields.get(field, 0) + increment
+    leaderboards.setdefault(quiz, SortedIndex()).add(solution.user, solution.score)
+
+
+async def save_solution(solution: SolutionRec):
+    """Save new Solution with its indexes and statistics, returning None if already solved."""
+    if ("solution", solution.uuid) in records_by_key:
+        return None
+    created = time.time()
+    records_by_key[("solution", solution.uuid)] = encoder.encode(solution)
+    indexes.setdefault(("solutions", solution.user), SortedIndex()).add(solution.uuid, created, nx=True)
+    indexes.setdefault(("quiz_solutions", solution.quiz), SortedIndex()).add(solution.uuid, created, nx=True)
+    update_stats(solution.quiz, solution)
+    return solution
+
+
+async def save_solutions(solutions: list):
+    return [await save_solution(solution) for solution in solutions]
+
+
+async def user_solutions(user: str, limit: int, cursor: str = ""):
+    return read_indexed("solution", "solutions", user, Solution, limit, cursor)
+
+
+async def quiz_solutions(owner: str, quiz: str, limit: int, cursor: str = ""):
+    if quiz.split("-", 1)[0] != owner:
+        return [], ""
+    return read_indexed("solution", "quiz_solutions", quiz, Solution, limit, cursor)
+
+
+async def iter_quiz_solutions(owner: str, quiz: str):
+    """Asynchronously yield lists of Solutions recorded for UUID quiz owned by UUID owner, one chunk at a time."""
+    cursor = None
+    while cursor != "":
+        solutions, cursor = await quiz_solutions(owner, quiz, PAGE_CHUNK, cursor or "")
+        if solutions:
+            yield solutions
+
+
+async def quiz_stats(quiz: str):
+    return records.quiz_stats(quiz, stats.get(quiz, {}), await read_compiled_quiz(quiz))
+
+
+async def rebuild_quiz_stats(quiz: str):
+    """Recompute running statistics and leaderboard for UUID quiz from all its saved Solutions."""
+    stats.pop(quiz, None)
+    leaderboards.pop(quiz, None)
+    for _, uuid in indexes.get(("quiz_solutions", quiz), SortedIndex()).entries:
+        solution = read_record("solution", uuid, Solution)
+        if solution:
+            update_stats(quiz, solution)
+    return stats.get(quiz, {}).get("count", 0)
+
+
+async def quiz_leaderboard(quiz: str, limit: int, offset: int = 0):
+    """Return page of LeaderboardEntry for UUID quiz from highest score, where equal scores share the same rank."""
+    entries = leaderboards.get(quiz, SortedIndex())
+    end = len(entries) - offset
+    leaderboard = []
+    for position, (score, user) in enumerate(reversed(entries.entries[max(end - limit, 0):max(end, 0)]), offset + 1):
+        if leaderboard and leaderboard[-1].score == score:
+            rank = leaderboard[-1].rank
+        elif leaderboard:
+            rank = position
+        else:
+            rank = len(entries) - entries.count_upto(score) + 1
+        leaderboard.append(LeaderboardEntry(rank=rank, user=user, score=score))
+    return leaderboard
+
+
+async def quiz_rank(quiz: str, user: str):
+    """Return QuizRank of UUID user on UUID quiz leaderboard, or None if user has no Solution."""
+    entries = leaderboards.get(quiz, SortedIndex())
+    score = entries.scores.get(user)
+    if score is None:
+        return None
+    count, lower = len(entries), entries.count_below(score)
+    return QuizRank(quiz=quiz, user=user, score=score, rank=count - entries.count_upto(score) + 1, count=count,
+                    percentile=100 * lower / count)
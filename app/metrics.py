@@ -0,0 +1,213 @@
+"""
+Hand-rolled request metrics for a single worker, exposed in Prometheus text format at ``/metrics``.
+
+MetricsMiddleware times every request by route template, and collects the time spent in each phase of the request,
+e.g. Redis round trips, bcrypt, JWT and model (de)serialisation, as recorded by ``timed`` and ``count_redis``.
+Clients can send ``X-Server-Timing: 1`` to have the phases of their own request returned in a Server-Timing header.
+Metrics are per worker process, so scrape each worker or aggregate them in Prometheus.
+"""
+import time
+import contextvars
+from contextlib import contextmanager
+
+import cache
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+SERVER_TIMING_HEADER = b"x-server-timing"
+
+metrics = []  # All metrics created, for exposition
+
+
+def format_labels(names: tuple, values: tuple, extra: str = ""):
+    pairs = ['{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return pairs and "{" + ",".join(pairs) + "}" or ""
+
+
+class Counter:
+    """Monotonic count by label values."""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = {}
+        metrics.append(self)
+
+    def inc(self, amount: float = 1, *labels):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def expose(self):
+        for labels, value in sorted(self.values.items()):
+            yield "{}{} {}".format(self.name, format_labels(self.labels, labels), value)
+
+
+class Gauge:
+    """Current value returned by function when exposed."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, function):
+        self.name, self.help, self.function = name, help, function
+        metrics.append(self)
+
+    def expose(self):
+        yield "{} {}".format(self.name, self.function())
+
+
+class Histogram:
+    """Distribution of observations in cumulative buckets by label values."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        self.values = {}  # labels: [bucket counts..., sum, count]
+        metrics.append(self)
+
+    def observe(self, value: float, *labels):
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        counts[-2] += value
+        counts[-1] += 1
+
+    def expose(self):
+        for labels, counts in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                extra = 'le="{}"'.format(bound)
+                yield "{}_bucket{} {}".format(self.name, format_labels(self.labels, labels, extra), cumulative)
+            extra = 'le="+Inf"'
+            yield "{}_bucket{} {}".format(self.name, format_labels(self.labels, labels, extra), counts[-1])
+            yield "{}_sum{} {}".format(self.name, format_labels(self.labels, labels), counts[-2])
+            yield "{}_count{} {}".format(self.name, format_labels(self.labels, labels), counts[-1])
+
+
+requests_total = Counter("http_requests_total", "Requests handled", ("method", "route", "status"))
+request_seconds = Histogram("http_request_duration_seconds", "Request latency", ("method", "route"))
+request_redis_commands = Histogram("http_request_redis_commands", "Redis commands per request", ("method", "route"),
+                                   COUNT_BUCKETS)
+request_redis_round_trips = Histogram("http_request_redis_round_trips", "Redis round trips per request",
+                                      ("method", "route"), COUNT_BUCKETS)
+phase_seconds = Histogram("phase_duration_seconds", "Time spent in each phase of handling requests", ("phase",))
+redis_commands_total = Counter("redis_commands_total", "Redis commands sent, counting each pipelined command")
+redis_round_trips_total = Counter("redis_round_trips_total", "Redis round trips, counting a pipeline as one")
+
+
+class RequestTimings:
+    """Phase durations and Redis counts of the current request."""
+
+    def __init__(self):
+        self.phases = {}  # phase: seconds
+        self.redis_commands = self.redis_round_trips = 0
+
+
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def timed(phase: str):
+    """Time the enclosed block as phase, for the phase histogram and the current request's timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        phase_seconds.observe(elapsed, phase)
+        timings = request_timings.get()
+        if timings:
+            timings.phases[phase] = timings.phases.get(phase, 0) + elapsed
+
+
+@contextmanager
+def count_redis(commands: int):
+    """Time the enclosed block as one Redis round trip sending given number of commands."""
+    redis_commands_total.inc(commands)
+    redis_round_trips_total.inc()
+    timings = request_timings.get()
+    if timings:
+        timings.redis_commands += commands
+        timings.redis_round_trips += 1
+    with timed("redis"):
+        yield
+
+
+def server_timing(timings: RequestTimings, total: float):
+    """Return Server-Timing header value for request timings, durations in milliseconds."""
+    entries = ['total;dur={:.2f}'.format(total * 1000)]
+    for phase, seconds in sorted(timings.phases.items()):
+        entry = '{};dur={:.2f}'.format(phase, seconds * 1000)
+        if phase == "redis":
+            entry += ';desc="{} commands in {} round trips"'.format(timings.redis_commands, timings.redis_round_trips)
+        entries.append(entry)
+    return ", ".join(entries)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and Redis use per route, adding Server-Timing when requested."""
+
+    def __init__(self, app):
+        self.app = app
+        self.routes = {}  # endpoint: route path template
+
+    def route(self, scope: dict):
+        """Return route path template of the endpoint that handled the request, bounding label values."""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if endpoint not in self.routes:
+            for route in scope["app"].routes:
+                self.routes.setdefault(getattr(route, "endpoint", None), getattr(route, "path", "unmatched"))
+        return self.routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        requested = any(name == SERVER_TIMING_HEADER for name, _ in scope["headers"])
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_timed(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if requested:
+                    header = server_timing(timings, time.perf_counter() - start).encode("latin-1")
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            request_timings.reset(token)
+            method, route = scope["method"], self.route(scope)
+            requests_total.inc(1, method, route, status_code)
+            request_seconds.observe(time.perf_counter() - start, method, route)
+            request_redis_commands.observe(timings.redis_commands, method, route)
+            request_redis_round_trips.observe(timings.redis_round_trips, method, route)
+
+
+def expose():
+    """Return all metrics, and cache counters, in Prometheus text exposition format."""
+    lines = []
+    for metric in metrics:
+        lines.append("# HELP {} {}".format(metric.name, metric.help))
+        lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+        lines.extend(metric.expose())
+    for name, kind in (("size", "gauge"), ("capacity", "gauge"), ("hits", "counter"), ("misses", "counter"),
+                       ("evictions", "counter")):
+        metric = "cache_{}".format(name) + (kind == "counter" and "_total" or "")
+        lines.append("# HELP {} In-process cache {}".format(metric, name))
+        lines.append("# TYPE {} {}".format(metric, kind))
+        for cache_name, stats in sorted(cache.stats().items()):
+            lines.append('{}{{cache="{}"}} {}'.format(metric, cache_name, stats[name]))
+    return "\n".join(lines) + "\n"
@@ -6,7 +6,7 @@ Application structure is simplified for this project.
 All models are contained in this file.
 Settings are case insensitive securely captured from the environment.
 """
-from typing import Union, List
+from typing import Union, List, Dict
 from pydantic import BaseModel
 from pydantic import BaseSettings
 
@@ -15,6 +15,29 @@ class JWTSettings(BaseSettings):
     jwt_signature: str
     jwt_algorithm: str = "HS256"
     jwt_expire_minutes: int = 60
+    jwt_claims: bool = False  # Pack user uuid, name, active flag and revocation generation into tokens
+    jwt_backend: str = "jose"  # "jose" for python-jose or "pyjwt" for the faster PyJWT
+
+
+class BcryptSettings(BaseSettings):
+    bcrypt_executor: str = "thread"  # "thread" or "process" pool for password hashing
+    bcrypt_workers: int = 4
+    bcrypt_pending: int = 32  # Hashing operations in flight or queued before responding 503
+    bcrypt_retry_after: int = 2  # Seconds clients are asked to wait when hashing is saturated
+
+
+class CacheSettings(BaseSettings):
+    user_cache_size: int = 10000  # Authenticated users cached per worker, 0 disables
+    user_cache_ttl: float = 30  # Seconds, well below token lifetime, bounding staleness across workers
+    quiz_cache_size: int = 1000  # Compiled published quizzes cached per worker, 0 disables
+    quiz_cache_ttl: float = 300  # Seconds, bounding how long a deleted quiz can still be scored by other workers
+    token_cache_size: int = 10000  # Verified tokens cached per worker until they expire, 0 disables
+    published_max_age: int = 86400  # Seconds clients may reuse a published Quiz, which never changes, unchecked
+    revoked_cache_ttl: float = 10  # Seconds between refreshes of token revocations, bounding how long they take
+
+
+class StorageSettings(BaseSettings):
+    storage_backend: str = "redis"  # "redis", or "memory" for a single process without persistence, e.g. tests
 
 
 class RedisSettings(BaseSettings):
@@ -22,6 +45,17 @@ class RedisSettings(BaseSettings):
     redis_port: int
     redis_password: str
     redis_user: str = 'default'
+    redis_read_chunk: int = 500  # Keys per MGET when reading lists of records
+    redis_write_chunk: int = 500  # Commands per pipeline when writing batches of records
+    redis_max_connections: int = 64  # Connections shared by all in-flight requests of one worker
+    redis_pool_timeout: float = 5  # Seconds to wait for a free pooled connection
+    redis_socket_timeout: float = 5
+    redis_health_check_interval: int = 30  # Seconds idle before a pooled connection is checked
+    redis_write_behind: bool = False  # Acknowledge solutions once claimed, applying their updates in background
+    redis_write_behind_timeout: float = 10  # Seconds to apply queued solutions on shutdown, the rest stay pending
+    redis_codec: str = "json"  # Encoding of new records, "json" or "msgpack"; records in either are always readable
+    redis_key_version: int = 1  # Key layout, 2 for hash tagged keys (see manage.py rekey)
+    redis_cluster: bool = False  # Connect to Redis Cluster, which needs key version 2
 
 
 class Token(BaseModel):
@@ -71,6 +105,16 @@ class Quiz(BaseModel):
     questions: List[str] = []  # Uuids of questions assigned to this quiz
 
 
+class CompiledQuiz(BaseModel):
+    """Immutable snapshot of a published Quiz and its Questions compiled at publish time for scoring."""
+    uuid: str = ""  # "<owner>-<uuid>" UUID of the Quiz
+    owner: str = ""
+    title: str = ""
+    questions: List[str] = []  # Uuids of questions in quiz order
+    texts: List[str] = []  # Text of each question
+    correct: List[List[bool]] = []  # Correct answers of each question
+
+
 class Solution(BaseModel):
     """Solution UUIDs combine the UUID of the user submitting the solution with the combined quiz UUID."""
     uuid: str = ""  # "<user>-<owner>-<quiz>" UUID
@@ -85,3 +129,68 @@ class Solution(BaseModel):
 class SolutionRec(Solution):
     """Request body contains answers that are not returned in the response."""
     answers: List[List[bool]]  # For each Question in the Quiz there is a List[bool] of answers
+
+
+class QuestionStats(BaseModel):
+    """Running statistics for one question of a quiz, counting scores above, below or at zero."""
+    question: str = ""  # Question UUID, empty once the quiz is deleted
+    correct: int = 0
+    wrong: int = 0
+    skipped: int = 0
+    average: float = 0  # Average percentage score
+
+
+class QuizStats(BaseModel):
+    """Running statistics for all saved solutions of a quiz."""
+    quiz: str = ""  # "<owner>-<quiz>" UUID
+    count: int = 0  # Solutions saved
+    average: float = 0  # Average overall percentage score
+    histogram: Dict[int, int] = {}  # Solutions by overall score in buckets of 10 keyed by lower bound, -100 to 90
+    questions: List[QuestionStats] = []
+
+
+class LeaderboardEntry(BaseModel):
+    """User's overall score and rank on a quiz leaderboard, where equal scores share a rank."""
+    rank: int
+    user: str  # "<user>" UUID
+    score: int
+
+
+class QuizRank(BaseModel):
+    """User's rank on a quiz leaderboard, and percentage of other solutions scoring lower."""
+    quiz: str  # "<owner>-<quiz>" UUID
+    user: str  # "<user>" UUID
+    score: int
+    rank: int
+    count: int  # Solutions ranked
+    percentile: float
+
+
+class SolutionResult(BaseModel):
+    """Outcome of one submission in a batch: the recorded Solution, or the status code and detail of its error."""
+    index: int  # Position of the submission in the batch
+    status_code: int = 200
+    detail: str = ""
+    solution: Union[Solution, None] = None
+
+
+class QuizImport(BaseModel):
+    """Quiz to import with its new Questions given in full, in quiz order."""
+    title: str = ""
+    published: bool = False
+    questions: List[Question] = []
+
+
+class Import(BaseModel):
+    """Document of new Questions and Quizzes to import together."""
+    questions: List[Question] = []
+    quizzes: List[QuizImport] = []
+
+
+class ImportResult(BaseModel):
+    """Outcome of importing one Question or Quiz: its new UUID, or the status code and detail of its error."""
+    kind: str  # "question" or "quiz"
+    index: int  # Position in the document's questions or quizzes
+    status_code: int = 200
+    detail: str = ""
+    uuid: str = ""
@@ -0,0 +1,88 @@
+"""
+Record logic shared by every storage backend, so backends differ only in how records are stored:
+rules for updating Questions and Quizzes, compiled quiz snapshots, page cursors and quiz statistics.
+"""
+import base64
+
+from models import Question, Quiz, CompiledQuiz, Solution, QuizStats, QuestionStats
+
+
+def update_question(question: Question, old_question: Question):
+    """Fill update of Question from its stored version, keeping answers and correct flags the same length."""
+    question.owner = old_question.owner
+    question.text = question.text or old_question.text
+    question.answers = question.answers or old_question.answers
+    question.correct = question.correct or old_question.correct
+    if len(question.answers) > len(question.correct):
+        question.answers = question.answers[0:len(question.correct)]
+    elif len(question.answers) < len(question.correct):
+        question.correct = question.correct[0:len(question.answers)]
+    return question
+
+
+def update_quiz(quiz: Quiz, old_quiz: Quiz):
+    """Fill update of Quiz from its stored version."""
+    quiz.owner = old_quiz.owner
+    quiz.title = quiz.title or old_quiz.title
+    quiz.questions = quiz.questions or old_quiz.questions
+    return quiz
+
+
+def compiled_quiz(quiz: Quiz, questions: list):
+    """Return CompiledQuiz snapshot of Quiz with its Questions in quiz order."""
+    return CompiledQuiz(
+        uuid=quiz.uuid,
+        owner=quiz.owner,
+        title=quiz.title,
+        questions=quiz.questions,
+        texts=[question.text for question in questions],
+        correct=[question.correct for question in questions],
+    )
+
+
+def encode_cursor(created: float, uuid: str):
+    """Return opaque page cursor for the position of UUID in a creation ordered index."""
+    return base64.urlsafe_b64encode(" ".join((repr(created), uuid)).encode('utf-8')).decode('utf-8')
+
+
+def decode_cursor(cursor: str):
+    """Return creation time and UUID from opaque page cursor, raising ValueError if malformed."""
+    try:
+        created, uuid = base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8').split(" ", 1)
+        return float(created), uuid
+    except (TypeError, UnicodeError, base64.binascii.Error) as error:
+        raise ValueError("Invalid cursor") from error
+
+
+def solution_stats(solution: Solution):
+    """
+    Return quiz statistics hash field increments for Solution: count, score sum and histogram bucket of 10 points,
+    with per question score sum and count of correct (positive), wrong (negative) or skipped (zero) scores.
+    """
+    stats = {"count": 1, "score_sum": solution.score, "bucket:{}".format(min(solution.score // 10 * 10, 90)): 1}
+    for index, score in enumerate(solution.scores):
+        outcome = score > 0 and "correct" or score < 0 and "wrong" or "skipped"
+        stats["{}:{}".format(outcome, index)] = 1
+        stats["score_sum:{}".format(index)] = score
+    return stats
+
+
+def quiz_stats(quiz: str, stats: dict, compiled: CompiledQuiz = None):
+    """Return QuizStats for UUID quiz from its running statistics fields, naming questions from its snapshot."""
+    count = stats.get("count", 0)
+    questions = compiled and compiled.questions or []  # Question UUIDs unknown once quiz is deleted
+    scored = [int(field.split(":")[1]) + 1 for field in stats if field.startswith("score_sum:")]
+    return QuizStats(
+        quiz=quiz,
+        count=count,
+        average=count and stats.get("score_sum", 0) / count,
+        histogram=dict((int(field.split(":")[1]), value) for field, value in stats.items()
+                       if field.startswith("bucket:")),
+        questions=[QuestionStats(
+            question=index < len(questions) and questions[index] or "",
+            correct=stats.get("correct:{}".format(index), 0),
+            wrong=stats.get("wrong:{}".format(index), 0),
+            skipped=stats.get("skipped:{}".format(index), 0),
+            average=count and stats.get("score_sum:{}".format(index), 0) / count,
+        ) for index in range(max([len(questions)] + scored))],
+    )
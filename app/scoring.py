@@ -0,0 +1,138 @@
+"""
+Scoring of quiz solutions, one solution at a time or in vectorised batches.
+Scores are calculated x 1,000 per question and returned as rounded percentages.
+
+:Correct answer:   1 point
+:Skipped question: 0 points
+:Incorrect answer: -1 points
+
+Multiple answer questions count fractions of a point per correct / incorrect answer.
+Batch scoring with NumPy gives results identical to scoring each solution individually,
+accumulating in the same order so floating point rounding also matches.
+"""
+from typing import List
+from itertools import chain
+import numpy
+from fastapi import HTTPException, status
+
+from models import CompiledQuiz, SolutionRec
+
+
+def score_single_answer_question(uuid: str, correct: List[bool], answers: List[bool]):
+    """Return question score scaled x 1,000 for question requiring only one answer."""
+    if sum(answers) == 0:
+        return 0  # Skipped question
+    if sum(answers) > 1:
+        detail = "Multiple answers for single answer question '{}'".format(uuid)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+    return answers[correct.index(True)] and 1000 or -1000
+
+
+def score_multi_answer_question(uuid: str, correct: List[bool], answers: List[bool]):
+    """Return question score scaled x 1,000 for question allowing multiple answers."""
+    if sum(answers) == 0:
+        return 0  # Skipped question
+    right = sum(correct)
+    wrong = len(correct) - right
+    right, wrong = 1000 / right, -1000 / wrong
+    return sum(q and right or wrong for q, a in zip(correct, answers) if a)
+
+
+def score_question(uuid: str, correct: List[bool], answers: List[bool]):
+    """Return question score scaled x 1,000 for any question."""
+    if sum(correct) == 1:
+        return score_single_answer_question(uuid, correct, answers)
+    else:
+        return score_multi_answer_question(uuid, correct, answers)
+
+
+def score_quiz(quiz: CompiledQuiz, solution: SolutionRec):
+    """Return scored Quiz as updated SolutionRec given CompiledQuiz and SolutionRec."""
+    solution.title = quiz.title
+    solution.questions = []
+    solution.scores = []
+    solution.score = 0
+
+    for uuid, text, correct, answers in zip(quiz.questions, quiz.texts, quiz.correct, solution.answers):
+        solution.questions.append(text)
+
+        if len(correct) != len(answers):
+            detail = "Wrong number of answers for question '{}'".format(uuid)
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+        score = score_question(uuid, correct, answers)  # Score x 1,000
+        solution.score += score  # Score x 1,000
+        solution.scores.append(round(score / 10))  # Score x 100 percentage
+
+    solution.score = round((solution.score / len(solution.scores)) / 10)  # Overall quiz average question percentage
+    return solution
+
+
+def score_quiz_batch(quiz: CompiledQuiz, answer_sets: List[List[List[bool]]]):
+    """
+    Score many sets of answers to one CompiledQuiz at once with NumPy boolean matrices.
+    Return (scores, totals, errors) where scores is an N x questions array of percentage scores per question,
+    totals an array of N overall percentage scores, and errors a list of N HTTPException or None.
+    Scores and totals of answer sets with errors are undefined. Errors match those raised by score_quiz,
+    with "Answers are required" and "Wrong number of answers" checked first as create_solution does.
+    Multiple answer questions where every or no answer is correct cannot be scored once answered (500).
+    """
+    count = len(answer_sets)
+    widths = [len(correct) for correct in quiz.correct]
+    offsets = numpy.cumsum([0] + widths)
+    matrix = numpy.zeros((count, offsets[-1]), dtype=bool)  # All answers of each set side by side
+    limits = numpy.full(count, len(widths))  # Question index each answer set can be scored up to
+    errors = [None] * count
+    rows, flat = [], []  # Well formed answer sets, copied into the matrix together
+
+    for row, answers in enumerate(answer_sets):
+        if not answers:
+            errors[row] = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Answers are required")
+            limits[row] = 0
+        elif len(answers) != len(widths):
+            errors[row] = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Wrong number of answers")
+            limits[row] = 0
+        elif list(map(len, answers)) == widths:
+            rows.append(row)
+            flat.append(list(chain.from_iterable(answers)))
+        else:  # Score up to the first question with the wrong number of answers
+            limits[row] = next(index for index, width in enumerate(widths) if len(answers[index]) != width)
+            matrix[row, :offsets[limits[row]]] = list(chain.from_iterable(answers[:limits[row]]))
+    if rows:
+        matrix[rows] = numpy.array(flat, dtype=bool)
+
+    failed = numpy.array([error is not None for error in errors], dtype=bool)
+    scores = numpy.zeros((count, len(widths)))
+    totals = numpy.zeros(count)
+    for index, (uuid, correct) in enumerate(zip(quiz.questions, quiz.correct)):
+        for row in numpy.flatnonzero(~failed & (limits == index)):
+            detail = "Wrong number of answers for question '{}'".format(uuid)
+            errors[row] = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+            failed[row] = True
+        answers = matrix[:, offsets[index]:offsets[index + 1]]
+        answered = answers.sum(axis=1)
+        right = sum(correct)
+        score = numpy.zeros(count)
+        if right == 1:
+            invalid = answered > 1
+            detail = "Multiple answers for single answer question '{}'".format(uuid)
+            status_code = status.HTTP_400_BAD_REQUEST
+            score = numpy.where(answered == 0, 0.0, numpy.where(answers[:, correct.index(True)], 1000.0, -1000.0))
+        elif right == 0 or right == len(correct):
+            invalid = answered > 0  # score_multi_answer_question divides by zero
+            detail = "Cannot score question '{}'".format(uuid)
+            status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        else:
+            invalid = numpy.zeros(count, dtype=bool)
+            weights = [q and 1000 / right or -1000 / (len(correct) - right) for q in correct]
+            for answer, weight in enumerate(weights):  # Accumulate in answer order as score_multi_answer_question
+                score = score + numpy.where(answers[:, answer], weight, 0.0)
+        for row in numpy.flatnonzero(~failed & invalid):
+            errors[row] = HTTPException(status_code=status_code, detail=detail)
+            failed[row] = True
+        totals += score  # Accumulate in question order as score_quiz
+        scores[:, index] = score
+
+    scores = numpy.rint(scores / 10).astype(int)  # Round half to even as round()
+    totals = numpy.rint((totals / max(len(widths), 1)) / 10).astype(int)
+    return scores, totals, errors
@@ -0,0 +1,165 @@
+"""
+Storage backend interface used by the application, with the backend selected by the STORAGE_BACKEND setting:
+
+- "redis": Redis, see db.py, shared by any number of workers and hosts.
+- "memory": In-process dicts and sorted lists, see memdb.py, for a single worker without persistence,
+  such as tests and benchmarks, where the round trip to Redis would dominate.
+
+Backends are modules implementing the Storage protocol, and only the selected backend is imported.
+Its functions are re-exported here, so the application imports storage functions from this module.
+Record logic shared by backends, such as update rules and quiz statistics, is in records.py.
+"""
+import importlib
+from typing import AsyncIterator, Dict, List, Optional, Protocol, Tuple
+
+from models import StorageSettings, UserRec, Question, Quiz, CompiledQuiz, Solution, SolutionRec
+from models import QuizStats, LeaderboardEntry, QuizRank
+
+
+class Storage(Protocol):
+    """Operations every storage backend implements. Pages are returned with the opaque cursor of the next page."""
+
+    async def start(self) -> None:
+        """Prepare backend when the application starts."""
+
+    async def stop(self) -> None:
+        """Complete any pending writes when the application stops."""
+
+    async def get_user(self, username: str) -> Optional[UserRec]:
+        """Return UserRec for username (email), or None."""
+
+    async def get_cached_user(self, username: str) -> Optional[UserRec]:
+        """Return UserRec for username (email), possibly up to a few seconds stale, or None."""
+
+    async def save_user(self, user: dict) -> UserRec:
+        """Create new User, assigning its UUID."""
+
+    async def deactivate_user(self, username: str) -> Optional[UserRec]:
+        """Mark User inactive and revoke its tokens, returning updated UserRec or None if not found."""
+
+    async def revoke_user_tokens(self, username: str) -> Optional[UserRec]:
+        """Revoke all tokens issued to User so far, returning UserRec or None if not found."""
+
+    async def token_generation(self, uuid: str) -> int:
+        """Return current token generation of User UUID."""
+
+    async def revoked_generations(self) -> Dict[str, int]:
+        """Return dict of User UUID to token generation, where tokens of earlier generations are revoked."""
+
+    async def read_question(self, uuid: str) -> Optional[Question]:
+        """Return Question by UUID, or None."""
+
+    async def read_question_data(self, uuid: str) -> Optional[bytes]:
+        """Return stored bytes of Question by UUID, as decoded by codec.decode, or None."""
+
+    async def save_question(self, question: Question) -> Optional[Question]:
+        """Create Question, or update it if it has a UUID, returning None if not found."""
+
+    async def remove_question(self, uuid: str) -> Optional[Question]:
+        """Remove Question, returning it or None if not found."""
+
+    async def is_published_question(self, uuid: str) -> Optional[bool]:
+        """Return True if Question is published, False if only in unpublished quizzes, None if unused."""
+
+    async def user_questions(self, owner: str, limit: int, cursor: str = "") -> Tuple[List[Question], str]:
+        """Return page of Questions owned by UUID owner in creation order."""
+
+    async def read_quiz(self, uuid: str) -> Optional[Quiz]:
+        """Return Quiz by UUID, or None."""
+
+    async def read_quiz_data(self, uuid: str) -> Optional[bytes]:
+        """Return stored bytes of Quiz by UUID, as decoded by codec.decode, or None."""
+
+    async def save_quiz(self, quiz: Quiz) -> Optional[Quiz]:
+        """Create Quiz, or update it if it has a UUID, returning None if not found or already published."""
+
+    async def remove_quiz(self, uuid: str) -> Optional[Quiz]:
+        """Remove Quiz, returning it or None if not found."""
+
+    async def user_quizzes(self, owner: str, limit: int, cursor: str = "") -> Tuple[List[Quiz], str]:
+        """Return page of Quizzes owned by UUID owner in creation order."""
+
+    async def read_compiled_quiz(self, uuid: str) -> Optional[CompiledQuiz]:
+        """Return CompiledQuiz for published Quiz, or None if not published or any Question is missing."""
+
+    async def import_questions_quizzes(self, questions: list, quizzes: list) -> Tuple[list, list]:
+        """Save new Questions, and new Quizzes each given as a pair of Quiz and its new Questions, assigning UUIDs."""
+
+    async def read_solution(self, uuid: str) -> Optional[Solution]:
+        """Return Solution by UUID, or None."""
+
+    async def read_solution_data(self, uuid: str) -> Optional[bytes]:
+        """Return stored bytes of SolutionRec by UUID, including its answers, or None."""
+
+    async def save_solution(self, solution: SolutionRec) -> Optional[SolutionRec]:
+        """Save new Solution with its indexes and statistics, returning None if already solved."""
+
+    async def save_solutions(self, solutions: list) -> List[Optional[SolutionRec]]:
+        """Save each new Solution, returning list of saved Solution, or None where already solved."""
+
+    async def user_solutions(self, user: str, limit: int, cursor: str = "") -> Tuple[List[Solution], str]:
+        """Return page of Solutions by UUID user."""
+
+    async def quiz_solutions(self, owner: str, quiz: str, limit: int, cursor: str = "") -> Tuple[List[Solution], str]:
+        """Return page of Solutions for UUID quiz owned by UUID owner."""
+
+    def iter_quiz_solutions(self, owner: str, quiz: str) -> AsyncIterator[List[Solution]]:
+        """Asynchronously yield lists of Solutions for UUID quiz owned by UUID owner."""
+
+    async def quiz_stats(self, quiz: str) -> QuizStats:
+        """Return running QuizStats for UUID quiz."""
+
+    async def rebuild_quiz_stats(self, quiz: str) -> int:
+        """Recompute statistics and leaderboard for UUID quiz from its Solutions, returning their number."""
+
+    async def quiz_leaderboard(self, quiz: str, limit: int, offset: int = 0) -> List[LeaderboardEntry]:
+        """Return page of LeaderboardEntry for UUID quiz from highest score."""
+
+    async def quiz_rank(self, quiz: str, user: str) -> Optional[QuizRank]:
+        """Return QuizRank of UUID user on UUID quiz, or None if user has no Solution."""
+
+
+backends = {"redis": "db", "memory": "memdb"}  # Backend name: module
+
+
+def get_backend(name: str) -> Storage:
+    """Return backend module by name, importing it, raising ValueError for unknown names."""
+    if name not in backends:
+        raise ValueError("Unknown storage backend '{}', expected one of {}".format(name, ", ".join(backends)))
+    return importlib.import_module(backends[name])
+
+
+backend = get_backend(StorageSettings().storage_backend)
+start = backend.start
+stop = backend.stop
+get_user = backend.get_user
+get_cached_user = backend.get_cached_user
+save_user = backend.save_user
+deactivate_user = backend.deactivate_user
+revoke_user_tokens = backend.revoke_user_tokens
+token_generation = backend.token_generation
+revoked_generations = backend.revoked_generations
+read_question = backend.read_question
+read_question_data = backend.read_question_data
+save_question = backend.save_question
+remove_question = backend.remove_question
+is_published_question = backend.is_published_question
+user_questions = backend.user_questions
+read_quiz = backend.read_quiz
+read_quiz_data = backend.read_quiz_data
+save_quiz = backend.save_quiz
+remove_quiz = backend.remove_quiz
+user_quizzes = backend.user_quizzes
+read_compiled_quiz = backend.read_compiled_quiz
+import_questions_quizzes = backend.import_questions_quizzes
+read_solution = backend.read_solution
+read_solution_data = backend.read_solution_data
+save_solution = backend.save_solution
+save_solutions = backend.save_solutions
+user_solutions = backend.user_solutions
+quiz_solutions = backend.quiz_solutions
+iter_quiz_solutions = backend.iter_quiz_solutions
+quiz_stats = backend.quiz_stats
+rebuild_quiz_stats = backend.rebuild_quiz_stats
+quiz_leaderboard = backend.quiz_leaderboard
+quiz_rank = backend.quiz_rank
@@ -0,0 +1,215 @@
+"""
+Tests of API endpoints driven in-process, against fakeredis or the in-process storage backend, see conftest.py.
+These tests do not need Redis.
+"""
+import asyncio
+
+import pytest
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def login(client, email: str):
+    """Register user with email and return its authorisation headers and UUID."""
+    response = await client.post("/api/v1/users", json={"email": email, "name": email, "plain": "secret"})
+    assert response.status_code == 200, response.text
+    token = (await client.post("/token", data={"username": email, "password": "secret"})).json()["access_token"]
+    return {"Authorization": "Bearer " + token}, response.json()["uuid"]
+
+
+async def create_quiz(client, owner: dict, correct: list, published: bool = True):
+    """Create quiz of questions with given lists of correct flags, returning its UUID."""
+    uuids = []
+    for number, flags in enumerate(correct):
+        question = {"text": "Question {}".format(number), "answers": ["Answer"] * len(flags), "correct": flags}
+        uuids.append((await client.post("/api/v1/questions", json=question, headers=owner)).json()["uuid"])
+    quiz = (await client.post("/api/v1/quizzes", json={"title": "Quiz", "questions": uuids}, headers=owner)).json()
+    if published:
+        response = await client.put("/api/v1/quizzes/" + quiz["uuid"], json={"published": True}, headers=owner)
+        assert response.status_code == 200, response.text
+    return quiz["uuid"]
+
+
+@pytest.fixture
+def scenario(api_client):
+    """Return function running coroutine function of client, owner headers and user headers in one event loop."""
+    def run_scenario(function):
+        async def scenario():
+            async with api_client() as client:
+                owner, _ = await login(client, "owner@example.com")
+                user, _ = await login(client, "user@example.com")
+                return await function(client, owner, user)
+        return run(scenario())
+    return run_scenario
+
+
+def test_concurrent_duplicate_solution(scenario):
+    """Test the same solution submitted twice at once is saved exactly once, the other refused as a repeat."""
+    async def submit_twice(client, owner, user):
+        quiz = await create_quiz(client, owner, [[True, False]])
+        solution = {"quiz": quiz, "answers": [[True, False]]}
+        responses = await asyncio.gather(*(client.post("/api/v1/solutions", json=solution, headers=user)
+                                           for _ in range(2)))
+        listed = (await client.get("/api/v1/solutions", headers=user)).json()
+        stats = (await client.get("/api/v1/quizzes/{}/stats".format(quiz), headers=owner)).json()
+        return responses, listed, stats
+    responses, listed, stats = scenario(submit_twice)
+    assert sorted(response.status_code for response in responses) == [200, 403]
+    assert [response.json()["detail"] for response in responses if response.status_code == 403] == [
+        "Cannot repeat Quiz"]
+    assert (len(listed), stats["count"]) == (1, 1)
+
+
+def test_solution_batch_results(scenario):
+    """Test each submission of a batch gets its own result, malformed ones included, in submission order."""
+    async def submit_batch(client, owner, user):
+        quiz = await create_quiz(client, owner, [[True, False], [False, True]])
+        other = await create_quiz(client, owner, [[True]])
+        unpublished = await create_quiz(client, owner, [[True]], published=False)
+        await client.post("/api/v1/solutions", json={"quiz": other, "answers": [[True]]}, headers=user)
+        batch = [
+            {"quiz": quiz, "answers": [[True, False], [True, False]]},  # Saved
+            {"quiz": quiz},  # No answers
+            "not a submission",
+            {"quiz": unpublished, "answers": [[True]]},
+            {"quiz": other, "answers": [[True]]},  # Solved before
+            {"quiz": quiz, "answers": [[True, False]]},  # Wrong number of answers
+            {"answers": [[True]]},  # No quiz
+        ]
+        response = await client.post("/api/v1/solutions/batch", json=batch, headers=user)
+        return response, (await client.get("/api/v1/solutions", headers=user)).json()
+    response, listed = scenario(submit_batch)
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["index"] for result in results] == list(range(7))
+    assert [result["status_code"] for result in results] == [200, 422, 422, 403, 403, 400, 400]
+    assert (results[0]["solution"]["scores"], results[0]["solution"]["score"]) == ([100, -100], 0)
+    assert "answers" not in results[0]["solution"]
+    assert results[1]["detail"] == "answers: field required"
+    assert (results[3]["detail"], results[4]["detail"]) == ("Cannot take unpublished Quiz", "Cannot repeat Quiz")
+    assert all(result["solution"] is None for result in results[1:])
+    assert len(listed) == 2
+
+
+def test_solution_batch_too_large(scenario, monkeypatch):
+    """Test batches over BATCH_MAX are refused as a whole."""
+    import main
+    monkeypatch.setattr(main, "BATCH_MAX", 2)
+
+    async def submit_batch(client, owner, user):
+        return await client.post("/api/v1/solutions/batch", json=[{}] * 3, headers=user)
+    assert scenario(submit_batch).status_code == 400
+
+
+async def solve(client, quiz: str, answer_sets: list):
+    """Register a user for each answer set to submit to quiz, returning their headers and UUIDs."""
+    users = []
+    for number, answers in enumerate(answer_sets):
+        headers, uuid = await login(client, "solver{}@example.com".format(number))
+        response = await client.post("/api/v1/solutions", json={"quiz": quiz, "answers": answers}, headers=headers)
+        assert response.status_code == 200, response.text
+        users.append((headers, uuid))
+    return users
+
+
+ANSWER_SETS = [  # For two single answer questions, correct answers first then second
+    [[True, False], [False, True]],  # 100, 100: score 100
+    [[False, True], [False, False]],  # -100, 0 (skipped): score -50
+    [[True, False], [True, False]],  # 100, -100: score 0
+    [[True, False], [True, False]],  # Tied on 0
+]
+
+
+def test_quiz_stats(scenario):
+    """Test running statistics count solutions, score buckets including negative ones, and outcomes per question."""
+    async def stats(client, owner, user):
+        quiz = await create_quiz(client, owner, [[True, False], [False, True]])
+        await solve(client, quiz, ANSWER_SETS)
+        url = "/api/v1/quizzes/{}/stats".format(quiz)
+        return quiz, await client.get(url, headers=owner), await client.get(url, headers=user)
+    quiz, response, other = scenario(stats)
+    stats = response.json()
+    assert (stats["quiz"], stats["count"], stats["average"]) == (quiz, 4, 12.5)
+    assert stats["histogram"] == {"90": 1, "0": 2, "-50": 1}
+    assert [(question["correct"], question["wrong"], question["skipped"], question["average"])
+            for question in stats["questions"]] == [(3, 1, 0, 50), (1, 2, 1, -25)]
+    assert other.status_code == 401
+
+
+def test_leaderboard_and_rank(scenario):
+    """Test the leaderboard orders by score with ties sharing a rank, pages by offset, and ranks each solver."""
+    async def rankings(client, owner, user):
+        quiz = await create_quiz(client, owner, [[True, False], [False, True]])
+        solvers = await solve(client, quiz, ANSWER_SETS)
+        url = "/api/v1/quizzes/{}/".format(quiz)
+        leaderboard = (await client.get(url + "leaderboard", headers=user)).json()
+        page = (await client.get(url + "leaderboard", params={"limit": 2, "offset": 1}, headers=user)).json()
+        ranks = [(await client.get(url + "rank", headers=headers)).json() for headers, _ in solvers]
+        unranked = await client.get(url + "rank", headers=user)
+        return [uuid for _, uuid in solvers], leaderboard, page, ranks, unranked
+    solvers, leaderboard, page, ranks, unranked = scenario(rankings)
+    assert [(entry["rank"], entry["score"]) for entry in leaderboard] == [(1, 100), (2, 0), (2, 0), (4, -50)]
+    assert leaderboard[0]["user"] == solvers[0]
+    assert {entry["user"] for entry in leaderboard[1:3]} == {solvers[2], solvers[3]}
+    assert page == leaderboard[1:3]
+    assert [(rank["user"], rank["rank"], rank["count"], rank["percentile"]) for rank in ranks] == [
+        (solvers[0], 1, 4, 75), (solvers[1], 4, 4, 0), (solvers[2], 2, 4, 25), (solvers[3], 2, 4, 25)]
+    assert unranked.status_code == 404
+
+
+def test_leaderboard_access(scenario):
+    """Test leaderboards are 404 for unknown quizzes, owner only before publishing and public after."""
+    async def access(client, owner, user):
+        draft = await create_quiz(client, owner, [[True]], published=False)
+        quiz = await create_quiz(client, owner, [[True]])
+        url = "/api/v1/quizzes/{}/leaderboard"
+        return [(await client.get(url.format(uuid), headers=headers)).status_code for uuid, headers in (
+            (draft, owner), (draft, user), (quiz, owner), (quiz, user), (quiz.split("-")[0] + "-missing", user))]
+    assert scenario(access) == [200, 401, 200, 200, 404]
+
+
+def test_export_csv(scenario):
+    """Test CSV exports have the header row, with a column per question, whether or not the quiz has Solutions."""
+    async def export(client, owner, user):
+        quiz = await create_quiz(client, owner, [[True, False], [False, True]])
+        url = "/api/v1/quizzes/{}/solutions/export".format(quiz)
+        empty = await client.get(url, params={"format": "csv"}, headers=owner)
+        await solve(client, quiz, ANSWER_SETS[:2])
+        return empty, await client.get(url, params={"format": "csv"}, headers=owner)
+    empty, solved = scenario(export)
+    header = "uuid,user,quiz,title,score,question_1,question_2"
+    assert (empty.status_code, empty.headers["content-type"].split(";")[0]) == (200, "text/csv")
+    assert empty.text.splitlines() == [header]
+    lines = solved.text.splitlines()
+    assert lines[0] == header and sorted(line.split(",")[-3:] for line in lines[1:]) == [
+        ["-50", "-100", "0"], ["100", "100", "100"]]
+
+
+def test_quiz_conditional_get(scenario, monkeypatch):
+    """Test quizzes are 304 for current strong or weak ETags, without decoding, with Cache-Control by publish state."""
+    import codec
+    decoded = []
+    response_json = codec.response_json
+    monkeypatch.setattr(codec, "response_json", lambda *args: decoded.append(args) or response_json(*args))
+
+    async def conditional(client, owner, user):
+        results = []
+        for published in (True, False):
+            url = "/api/v1/quizzes/" + await create_quiz(client, owner, [[True]], published=published)
+            full = await client.get(url, headers=owner)
+            tag = full.headers["etag"]
+            decoded.clear()
+            responses = [await client.get(url, headers=dict(owner, **{"If-None-Match": match})) for match in (
+                tag, "W/" + tag, '"other", ' + tag)]
+            results.append((full, responses, len(decoded), await client.get(
+                url, headers=dict(owner, **{"If-None-Match": '"other"'}))))
+        return results
+    for (full, responses, decodes, mismatch), cache_control in zip(scenario(conditional), (
+            "private, max-age=86400, immutable", "private, no-cache")):
+        assert (full.status_code, full.headers["cache-control"]) == (200, cache_control)
+        assert [response.status_code for response in responses] == [304] * 3 and decodes == 0
+        assert all((response.headers["etag"], response.headers["cache-control"]) == (
+            full.headers["etag"], cache_control) for response in responses)
+        assert (mismatch.status_code, mismatch.json()["uuid"]) == (200, full.json()["uuid"])
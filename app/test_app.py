@@ -97,3 +97,35 @@ def test_repeat_quiz():
     assert response.status_code == 403
     response = response.json()
     assert response["detail"] == "Cannot repeat Quiz"
+
+
+def test_user_questions_pages():
+    """Test questions are returned in pages following the next cursor."""
+    response = client.get(url="/api/v1/questions", params={"limit": 2}, headers=gamma)
+    assert response.ok
+    assert len(response.json()) == 2
+    cursor = response.headers["X-Next-Cursor"]
+    texts = [r["text"] for r in response.json()]
+    response = client.get(url="/api/v1/questions", params={"limit": 2, "cursor": cursor}, headers=gamma)
+    assert response.ok
+    texts += [r["text"] for r in response.json()]
+    assert len(texts) == len(set(texts))
+    assert "Is the moon a star?" in texts
+
+
+def test_import():
+    """Test valid records are imported and invalid records report errors as when created individually."""
+    question = {"text": "Is ice cold?", "answers": ["Yes", "No"], "correct": [True, False]}
+    document = {
+        "questions": [question, {"text": "", "answers": ["Yes"], "correct": [True]}],
+        "quizzes": [{"title": "Imported", "published": True, "questions": [question, question]}],
+    }
+    response = client.post(url="/api/v1/import", json=document, headers=gamma)
+    assert response.ok
+    results = response.json()
+    assert [(r["kind"], r["status_code"]) for r in results] == [("question", 200), ("question", 400), ("quiz", 200)]
+    assert results[1]["detail"] == "Question text is required"
+    response = client.get(url="/api/v1/quizzes/" + results[2]["uuid"], headers=gamma)
+    assert response.ok
+    assert response.json()["published"]
+    assert len(response.json()["questions"]) == 2
@@ -0,0 +1,170 @@
+"""
+Tests for password hashing limits, access token caching and signed claims authorisation.
+These tests do not need Redis, see conftest.py.
+"""
+import time
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from jose import JWTError
+
+import auth
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_bcrypt_busy(monkeypatch):
+    """Test hashing is refused with 503 and Retry-After while every pending slot is taken, and allowed after."""
+    monkeypatch.setattr(auth, "bcrypt_pending", auth.PendingLimit(2))
+    assert auth.bcrypt_pending.acquire() and auth.bcrypt_pending.acquire()
+    with pytest.raises(HTTPException) as error:
+        run(auth.run_bcrypt(auth.password_hash, "secret"))
+    assert error.value.status_code == 503
+    assert error.value.headers["Retry-After"] == str(auth.bcrypt_settings.bcrypt_retry_after)
+    auth.bcrypt_pending.release()
+    assert auth.password_check("secret", run(auth.run_bcrypt(auth.password_hash, "secret")))
+    assert auth.bcrypt_pending.count == 1
+
+
+def test_bcrypt_limit_concurrent(monkeypatch):
+    """Test concurrent hashing beyond the limit is refused rather than queued."""
+    monkeypatch.setattr(auth, "bcrypt_pending", auth.PendingLimit(2))
+
+    async def hash_many():
+        return await asyncio.gather(*(auth.run_bcrypt(auth.password_hash, "secret") for _ in range(5)),
+                                    return_exceptions=True)
+    results = run(hash_many())
+    assert sum(isinstance(result, HTTPException) and result.status_code == 503 for result in results) == 3
+    assert auth.bcrypt_pending.count == 0
+
+
+def test_token_busy_response(fresh_storage, api_client, monkeypatch):
+    """Test logging in while hashing is saturated responds 503 with the Retry-After header."""
+    async def login():
+        await fresh_storage.save_user({"email": "alpha@example.com", "name": "Alpha",
+                                       "hashed": auth.password_hash("secret")})
+        monkeypatch.setattr(auth, "bcrypt_pending", auth.PendingLimit(1))
+        auth.bcrypt_pending.acquire()
+        async with api_client() as client:
+            return await client.post("/token", data={"username": "alpha@example.com", "password": "secret"})
+    response = run(login())
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(auth.bcrypt_settings.bcrypt_retry_after)
+
+
+async def claims_user(backend):
+    """Save user alpha, returning the UserRec and an access token packing its claims."""
+    user = await backend.save_user({"email": "alpha@example.com", "name": "Alpha", "hashed": "unused"})
+    return user, await auth.create_user_access_token(user)
+
+
+@pytest.fixture
+def claims(monkeypatch):
+    monkeypatch.setattr(auth, "JWT_CLAIMS", True)
+
+
+def test_claims_authorise_without_lookup(fresh_storage, claims, monkeypatch):
+    """Test tokens packing user claims authorise without looking up the user."""
+    async def authorise():
+        user, token = await claims_user(fresh_storage)
+        monkeypatch.setattr(auth, "get_cached_user", None)  # Calling it would fail
+        return user, await auth.get_current_user(token)
+    user, current = run(authorise())
+    assert (current.uuid, current.email, current.name, current.active) == (user.uuid, user.email, "Alpha", 1)
+
+
+def test_claims_revoked_by_generation(fresh_storage, claims):
+    """Test revoking a user's tokens denies tokens of earlier generations, but not tokens issued since."""
+    async def revoke():
+        user, token = await claims_user(fresh_storage)
+        await auth.get_current_user(token)
+        await fresh_storage.revoke_user_tokens(user.email)
+        with pytest.raises(HTTPException) as error:
+            await auth.get_current_user(token)
+        assert error.value.status_code == 401
+        return await auth.get_current_user(await auth.create_user_access_token(user))
+    assert run(revoke()).email == "alpha@example.com"
+
+
+def test_claims_revoked_by_other_worker(fresh_storage, claims):
+    """Test a generation bumped by another worker denies older tokens once the revocation copy refreshes."""
+    if fresh_storage.__name__ != "db":
+        pytest.skip("Revocations are only copied in-process by the Redis backend")
+
+    async def revoke():
+        user, token = await claims_user(fresh_storage)
+        await auth.get_current_user(token)  # Copies revocations
+        await fresh_storage.redis.hincrby(fresh_storage.REVOKED, user.uuid, 1)  # As by another worker
+        auth.token_cache.clear()
+        assert (await auth.get_current_user(token)).uuid == user.uuid  # Until the copy is refreshed
+        fresh_storage.revoked["expiry"] = 0
+        with pytest.raises(HTTPException):
+            await auth.get_current_user(token)
+    run(revoke())
+
+
+def test_token_without_uid_looks_up_user(fresh_storage, claims, monkeypatch):
+    """Test tokens without user claims, e.g. issued before JWT_CLAIMS was set, authorise by looking up the user."""
+    lookups = []
+
+    async def lookup(username: str):
+        lookups.append(username)
+        return await fresh_storage.get_cached_user(username)
+
+    async def authorise():
+        user, _ = await claims_user(fresh_storage)
+        monkeypatch.setattr(auth, "get_cached_user", lookup)
+        return user, await auth.get_current_user(auth.create_access_token({"sub": user.email}))
+    user, current = run(authorise())
+    assert (current.uuid, lookups) == (user.uuid, ["alpha@example.com"])
+
+
+class CountingBackend:
+    """JWT backend counting tokens it verifies."""
+
+    def __init__(self, backend):
+        self.backend, self.decoded = backend, 0
+
+    def encode(self, claims: dict):
+        return self.backend.encode(claims)
+
+    def decode(self, token: str):
+        self.decoded += 1
+        return self.backend.decode(token)
+
+
+@pytest.fixture
+def counting(monkeypatch):
+    monkeypatch.setattr(auth, "jwt_backend", CountingBackend(auth.jwt_backend))
+    auth.token_cache.clear()
+    return auth.jwt_backend
+
+
+def test_token_cache_skips_verification(counting):
+    """Test a repeated token is verified once, then served from the cache."""
+    token = auth.create_access_token({"sub": "alpha@example.com"})
+    assert auth.decode_access_token(token) == auth.decode_access_token(token)
+    assert counting.decoded == 1
+
+
+def test_expired_token_not_cached(counting):
+    """Test expired tokens are rejected every time, never cached."""
+    token = counting.encode({"sub": "alpha@example.com", "exp": int(time.time()) - 10})
+    for _ in range(2):
+        with pytest.raises(JWTError):
+            auth.decode_access_token(token)
+    assert counting.decoded == 2
+
+
+def test_tampered_token_rejected(counting):
+    """Test a token altered after its original was cached misses the cache and fails verification."""
+    token = auth.create_access_token({"sub": "alpha@example.com"})
+    auth.decode_access_token(token)
+    header, payload, signature = token.split(".")
+    tampered = ".".join((header, payload, signature[:-2] + (signature[-2] == "A" and "B" or "A") + signature[-1]))
+    with pytest.raises(JWTError):
+        auth.decode_access_token(tampered)
+    assert counting.decoded == 2
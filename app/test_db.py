@@ -0,0 +1,197 @@
+"""
+Tests for Redis key layouts, the instrumented cluster pipeline and the Lua scripts saving solutions.
+These tests do not need Redis, scripts run on fakeredis.
+"""
+import asyncio
+import time
+
+import pytest
+import redis
+
+import db
+import metrics
+from models import SolutionRec
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    import fakeredis.aioredis
+    monkeypatch.setattr(db, "redis", fakeredis.aioredis.FakeRedis())
+    return db.redis
+
+
+@pytest.fixture
+def writer(fake_redis, monkeypatch):
+    """Return a new solution writer in place of the worker's, with write behind enabled."""
+    monkeypatch.setattr(db.redis_settings, "redis_write_behind", True)
+    monkeypatch.setattr(metrics, "metrics", list(metrics.metrics))  # Leaving the writer's metrics out
+    monkeypatch.setattr(db, "solution_writer", db.SolutionWriter())
+    return db.solution_writer
+
+
+def solution(user: str, quiz: str, scores: list):
+    return SolutionRec(uuid="-".join((user, quiz)), user=user, quiz=quiz, title="Quiz", questions=["A"] * len(scores),
+                       scores=scores, score=sum(scores) // len(scores), answers=[[True]] * len(scores))
+
+
+KEYS = [  # prefix, uuid, version 1 key, version 2 key
+    ("question", "owner-question", "question-owner-question", "v2:question:{owner}-question"),
+    ("quiz", "owner-quiz", "quiz-owner-quiz", "v2:quiz:{owner}-quiz"),
+    ("compiled", "owner-quiz", "compiled-owner-quiz", "v2:compiled:{owner}-quiz"),
+    ("solution", "user-owner-quiz", "solution-user-owner-quiz", "v2:solution:user-{owner-quiz}"),
+    ("stats", "owner-quiz", "stats-owner-quiz", "v2:stats:{owner-quiz}"),
+    ("user", "alpha@example.com", "user:alpha@example.com", "v2:user:{alpha@example.com}"),
+]
+
+
+def test_keys():
+    """Test keys of both versions, and that their UUIDs are recovered."""
+    for prefix, uuid, v1, v2 in KEYS:
+        assert (db.key(prefix, uuid, 1), db.key(prefix, uuid, 2)) == (v1, v2)
+        assert (db.key_uuid(v1, 1), db.key_uuid(v2, 2)) == (uuid, uuid)
+
+
+def test_key_patterns():
+    """Test SCAN patterns match the keys of their prefix only."""
+    import fnmatch
+    for prefix, uuid, v1, v2 in KEYS:
+        for version, key in ((1, v1), (2, v2)):
+            matched = [other for other, *_ in KEYS if fnmatch.fnmatchcase(key, db.key_pattern(other, version))]
+            assert matched == [prefix], key
+
+
+def test_hash_tags_share_slots():
+    """Test keys written together in cluster mode hash to the same slot."""
+    slot = redis.cluster.key_slot
+    assert slot(db.key("question", "owner-a", 2).encode()) == slot(db.key("quiz", "owner-b", 2).encode())
+    assert slot(db.key("solution", "user-owner-quiz", 2).encode()) == slot(
+        db.key("stats", "owner-quiz", 2).encode())
+
+
+def test_cluster_pipeline_counts_commands(monkeypatch):
+    """Test cluster pipelines count each command and one round trip, without connecting."""
+    async def execute(self, raise_on_error=True, allow_redirections=True):
+        return [True] * len(self)
+    monkeypatch.setattr(redis.asyncio.cluster.ClusterPipeline, "execute", execute)
+    client = db.InstrumentedRedisCluster(host="localhost", port=6379)
+    pipe = client.pipeline()
+    assert isinstance(pipe, db.InstrumentedClusterPipeline)
+    pipe.set("a", 1)
+    pipe.get("a")
+    commands = metrics.redis_commands_total.values.get((), 0)
+    round_trips = metrics.redis_round_trips_total.values.get((), 0)
+    assert asyncio.run(pipe.execute()) == [True, True]
+    assert metrics.redis_commands_total.values[()] - commands == 2
+    assert metrics.redis_round_trips_total.values[()] - round_trips == 1
+
+
+def test_save_solution_once_concurrently(fake_redis):
+    """Test concurrent saves of the same solution store and index it exactly once."""
+    async def save_twice():
+        first = solution("user", "owner-quiz", [100])
+        saved = await asyncio.gather(db.save_solution(first), db.save_solution(solution("user", "owner-quiz", [-100])))
+        return saved, await db.read_solution(first.uuid), await db.quiz_stats("owner-quiz")
+    saved, stored, stats = asyncio.run(save_twice())
+    assert [bool(item) for item in saved] == [True, False]
+    assert (stored.score, stats.count) == (100, 1)
+
+
+def test_stats_scripts(fake_redis):
+    """Test the save scripts update running statistics, and rebuilding them from solutions gives the same."""
+    async def save():
+        saved = await db.save_solutions([solution(user, "owner-quiz", scores) for user, scores in (
+            ("a", [100, 100]), ("b", [-100, 0]), ("c", [100, -100]))])
+        stats = await db.quiz_stats("owner-quiz")
+        assert await db.rebuild_quiz_stats("owner-quiz") == 3
+        return saved, stats, await db.quiz_stats("owner-quiz")
+    saved, stats, rebuilt = asyncio.run(save())
+    assert all(saved) and rebuilt == stats
+    assert (stats.count, stats.histogram) == (3, {90: 1, -50: 1, 0: 1})
+    outcomes = [(question.correct, question.wrong, question.skipped, question.average) for question in stats.questions]
+    assert outcomes == [(2, 1, 0, 100 / 3), (1, 1, 1, 0)]
+
+
+def test_leaderboard_scripts(fake_redis):
+    """Test the save scripts rank equal scores together on the leaderboard, with percentiles of lower scores."""
+    async def rankings():
+        await db.save_solutions([solution("a", "owner-quiz", [50]), solution("b", "owner-quiz", [80]),
+                                 solution("c", "owner-quiz", [50])])
+        return (await db.quiz_leaderboard("owner-quiz", 10), await db.quiz_leaderboard("owner-quiz", 2, 1),
+                await db.quiz_rank("owner-quiz", "a"), await db.quiz_rank("owner-quiz", "d"))
+    leaderboard, page, rank, missing = asyncio.run(rankings())
+    assert [(entry.rank, entry.user) for entry in leaderboard] == [(1, "b"), (2, "c"), (2, "a")]
+    assert page == leaderboard[1:]
+    assert (rank.rank, rank.count, rank.percentile, missing) == (2, 3, 0, None)
+
+
+PENDING = db.key(db.PENDING_SOLUTIONS, "owner-quiz")
+
+
+async def pending_entries():
+    return [entry.decode("utf-8") for entry in await db.redis.lrange(PENDING, 0, -1)]
+
+
+def test_write_behind_applies_once(writer):
+    """Test claimed solutions are registered, applied removing their pending entries, and never applied twice."""
+    async def claim_and_apply():
+        solutions = [solution("a", "owner-quiz", [100]), solution("b", "owner-quiz", [-100])]
+        assert all(await db.save_solutions(solutions))
+        entries = await pending_entries()
+        assert len(entries) == 2 and await db.redis.smembers(db.PENDING_LISTS) == {PENDING.encode()}
+        assert await writer.flush(5)
+        applied = await db.quiz_stats("owner-quiz"), await pending_entries()
+        await writer.apply([(float(entry.split(" ", 1)[0]), PENDING, entry, item)
+                            for entry, item in zip(entries, solutions)])  # As if queued again
+        return applied, await db.quiz_stats("owner-quiz"), await db.quiz_leaderboard("owner-quiz", 10)
+    (stats, pending), again, leaderboard = asyncio.run(claim_and_apply())
+    assert (stats.count, pending, writer.lag()) == (2, [], 0)
+    assert again == stats and len(leaderboard) == 2
+
+
+def test_write_behind_recovery(writer):
+    """Test a new writer recovers solutions claimed by a stopped worker, keeping their claim times."""
+    async def crash_and_recover():
+        keys, args = db.claim_solution_keys_args(solution("a", "owner-quiz", [100]))
+        assert await db.claim_solution_script(keys=keys, args=args, client=db.redis)  # Never queued
+        await asyncio.sleep(0.1)
+        assert await writer.recover() == 1
+        lag = writer.lag()
+        assert await writer.flush(5)
+        return lag, await db.quiz_stats("owner-quiz"), await pending_entries()
+    lag, stats, pending = asyncio.run(crash_and_recover())
+    assert lag >= 0.1
+    assert (stats.count, pending) == (1, [])
+
+
+def test_write_behind_bounded_stop(writer, monkeypatch):
+    """Test stopping gives up on updates after the timeout, leaving them pending for the next worker."""
+    async def unavailable(batch):
+        raise redis.ConnectionError("Redis unavailable")
+    monkeypatch.setattr(writer, "apply", unavailable)
+    monkeypatch.setattr(db.redis_settings, "redis_write_behind_timeout", 0.2)
+
+    async def stop_and_restart():
+        assert await db.save_solution(solution("a", "owner-quiz", [100]))
+        started = time.monotonic()
+        await db.stop()
+        stopped = time.monotonic() - started, writer.task, await pending_entries()
+        monkeypatch.setattr(db, "solution_writer", db.SolutionWriter())
+        await db.start()
+        assert await db.solution_writer.flush(5)
+        return stopped, await db.quiz_stats("owner-quiz")
+    (elapsed, task, pending), stats = asyncio.run(stop_and_restart())
+    assert elapsed < 1 and task is None and len(pending) == 1
+    assert stats.count == 1
+
+
+def test_start_recovers_only_with_write_behind(fake_redis, monkeypatch):
+    """Test workers look for pending solutions on startup only with write behind enabled."""
+    recovered = []
+
+    async def recover():
+        recovered.append(db.redis_settings.redis_write_behind)
+    monkeypatch.setattr(db.solution_writer, "recover", recover)
+    for write_behind in (False, True):
+        monkeypatch.setattr(db.redis_settings, "redis_write_behind", write_behind)
+        asyncio.run(db.start())
+    assert recovered == [True]
@@ -0,0 +1,111 @@
+"""
+Tests for the in-process storage backend, which must behave as the Redis backend does.
+These tests do not need Redis.
+"""
+import os
+import asyncio
+import inspect
+
+import pytest
+
+import memdb
+from models import Question, Quiz, SolutionRec
+
+
+@pytest.fixture(autouse=True)
+def clear():
+    memdb.clear()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def solution(user: str, quiz: str, score: int):
+    return SolutionRec(uuid="-".join((user, quiz)), user=user, quiz=quiz, title="Quiz", questions=["A"],
+                       scores=[score], score=score, answers=[[True]])
+
+
+def test_implements_storage():
+    """Test memdb defines every Storage operation, asynchronous as declared."""
+    os.environ.setdefault("STORAGE_BACKEND", "memory")  # Importing storage imports the selected backend
+    import storage
+    for name, member in inspect.getmembers(storage.Storage, inspect.isfunction):
+        if not name.startswith("_"):
+            assert inspect.iscoroutinefunction(getattr(memdb, name)) == inspect.iscoroutinefunction(member), name
+
+
+def test_sorted_index_order():
+    """Test members are ordered by score then member, and updated unless nx."""
+    index = memdb.SortedIndex()
+    for member, score in (("b", 2), ("a", 2), ("c", 1)):
+        index.add(member, score)
+    index.add("c", 3, nx=True)
+    assert index.entries == [(1, "c"), (2, "a"), (2, "b")]
+    index.add("c", 3)
+    index.remove("a")
+    assert index.entries == [(2, "b"), (3, "c")]
+    assert (index.rank("c"), index.rank("a")) == (1, None)
+    assert (index.count_below(3), index.count_upto(2), index.count_upto(3)) == (1, 1, 2)
+
+
+def test_pages_resume_after_removed():
+    """Test cursor pages cover every question once, resuming after a question removed meanwhile."""
+    async def pages():
+        uuids = [(await memdb.save_question(Question(owner="owner", text=str(number)))).uuid for number in range(5)]
+        page, cursor = await memdb.user_questions("owner", 2)
+        await memdb.remove_question(page[-1].uuid)
+        seen = [question.uuid for question in page]
+        while cursor:
+            page, cursor = await memdb.user_questions("owner", 2, cursor)
+            seen.extend(question.uuid for question in page)
+        return uuids, seen
+    uuids, seen = run(pages())
+    assert seen == uuids
+
+
+def test_records_not_shared():
+    """Test changing a returned record does not change the stored record."""
+    async def change():
+        question = await memdb.save_question(Question(owner="owner", text="Stored"))
+        question.text = "Changed"
+        return await memdb.read_question(question.uuid)
+    assert run(change()).text == "Stored"
+
+
+def test_publish_and_compile():
+    """Test publishing a quiz compiles it and marks its questions published."""
+    async def publish():
+        question = await memdb.save_question(Question(owner="owner", text="Q", answers=["A"], correct=[True]))
+        quiz = await memdb.save_quiz(Quiz(owner="owner", title="Quiz", questions=[question.uuid]))
+        assert await memdb.is_published_question(question.uuid) is False
+        assert await memdb.read_compiled_quiz(quiz.uuid) is None
+        await memdb.save_quiz(Quiz(uuid=quiz.uuid, published=True))
+        assert await memdb.save_quiz(Quiz(uuid=quiz.uuid, title="Changed")) is None
+        assert await memdb.is_published_question(question.uuid) is True
+        compiled = await memdb.read_compiled_quiz(quiz.uuid)
+        await memdb.remove_quiz(quiz.uuid)
+        assert await memdb.is_published_question(question.uuid) is None
+        return compiled
+    compiled = run(publish())
+    assert (compiled.texts, compiled.correct) == (["Q"], [[True]])
+
+
+def test_solutions_leaderboard_and_rank():
+    """Test solutions are saved once, with equal scores sharing a rank as in Redis."""
+    async def solve():
+        saved = await memdb.save_solutions([solution("a", "owner-quiz", 50), solution("b", "owner-quiz", 80),
+                                            solution("c", "owner-quiz", 50), solution("a", "owner-quiz", 90)])
+        assert [bool(item) for item in saved] == [True, True, True, False]
+        leaderboard = await memdb.quiz_leaderboard("owner-quiz", 10)
+        page = await memdb.quiz_leaderboard("owner-quiz", 2, 1)
+        rank = await memdb.quiz_rank("owner-quiz", "a")
+        stats = await memdb.quiz_stats("owner-quiz")
+        assert await memdb.rebuild_quiz_stats("owner-quiz") == 3
+        assert await memdb.quiz_stats("owner-quiz") == stats
+        return leaderboard, page, rank, stats
+    leaderboard, page, rank, stats = run(solve())
+    assert [(entry.rank, entry.user) for entry in leaderboard] == [(1, "b"), (2, "c"), (2, "a")]
+    assert [(entry.rank, entry.user) for entry in page] == [(2, "c"), (2, "a")]
+    assert (rank.rank, rank.count, rank.percentile) == (2, 3, 0)
+    assert (stats.count, stats.average) == (3, 60)
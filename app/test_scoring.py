@@ -0,0 +1,104 @@
+"""
+Parity tests for batch scoring against scoring each solution individually.
+These tests do not need Redis.
+"""
+import random
+import pytest
+from fastapi import HTTPException
+
+from models import CompiledQuiz, SolutionRec
+from scoring import score_quiz, score_quiz_batch
+
+
+def score_one(quiz: CompiledQuiz, answers: list):
+    """Return (scores, score) or (status_code, detail) scoring individually with the checks of create_solution."""
+    if not answers:
+        return 400, "Answers are required"
+    if len(answers) != len(quiz.questions):
+        return 400, "Wrong number of answers"
+    try:
+        solution = score_quiz(quiz, SolutionRec(answers=answers))
+    except HTTPException as error:
+        return error.status_code, error.detail
+    except ZeroDivisionError:
+        return 500, None
+    return solution.scores, solution.score
+
+
+def score_many(quiz: CompiledQuiz, answer_sets: list):
+    """Return batch results in the same form as score_one."""
+    scores, totals, errors = score_quiz_batch(quiz, answer_sets)
+    results = []
+    for row, error in enumerate(errors):
+        if error is None:
+            results.append((scores[row].tolist(), int(totals[row])))
+        else:
+            results.append((error.status_code, error.status_code != 500 and error.detail or None))
+    return results
+
+
+def make_quiz(correct: list):
+    uuids = ["owner-q{}".format(number) for number in range(len(correct))]
+    return CompiledQuiz(uuid="owner-quiz", owner="owner", title="Quiz", questions=uuids,
+                        texts=["Question"] * len(correct), correct=correct)
+
+
+def random_answers(rng: random.Random, correct: list):
+    """Return mostly well formed random answers, occasionally with wrong lengths or missing questions."""
+    answers = [[rng.random() < 0.3 for _ in question] for question in correct]
+    roll = rng.random()
+    if roll < 0.05:
+        return []
+    if roll < 0.1:
+        return answers[:-1]
+    if roll < 0.15:
+        question = rng.randrange(len(answers))
+        answers[question] = answers[question] + [False]
+    return answers
+
+
+def test_example_scores():
+    """Test the documented example gives the same scores individually and in a batch."""
+    quiz = make_quiz([[False, True, False], [True, True, False, True, False], [False, True]])
+    answers = [[False, False, False], [True, True, True, False, False], [False, True]]
+    assert score_one(quiz, answers) == ([0, 17, 100], 39)
+    assert score_many(quiz, [answers]) == [([0, 17, 100], 39)]
+
+
+@pytest.mark.parametrize("answers, expected", [
+    ([[True, True], [True]], (400, "Multiple answers for single answer question 'owner-q0'")),
+    ([[True, False, False], [True]], (400, "Wrong number of answers for question 'owner-q0'")),
+    ([[False, True], [True, False]], (400, "Wrong number of answers for question 'owner-q1'")),
+    ([[True, True], [True, False]], (400, "Multiple answers for single answer question 'owner-q0'")),
+    ([[False, False], [False]], ([0, 0], 0)),
+    ([[True, False], [True]], ([-100, 100], 0)),
+])
+def test_errors_in_question_order(answers, expected):
+    """Test the first error in question order is reported, as when scoring individually."""
+    quiz = make_quiz([[False, True], [True]])
+    assert score_one(quiz, answers) == expected
+    assert score_many(quiz, [answers]) == [expected]
+
+
+def test_unscorable_multi_answer_question():
+    """Test answered questions with every answer correct fail in a batch where individual scoring fails."""
+    quiz = make_quiz([[True, True], [True, False, True]])
+    answer_sets = [[[True, False], [True, False, False]], [[False, False], [True, True, True]]]
+    assert score_many(quiz, answer_sets) == [score_one(quiz, answers) for answers in answer_sets]
+    assert score_many(quiz, answer_sets)[0] == (500, None)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_parity(seed):
+    """Test random quizzes and answer sets score identically individually and in a batch."""
+    rng = random.Random(seed)
+    correct = []
+    for _ in range(rng.randint(1, 10)):
+        width = rng.randint(1, 5)
+        question = [rng.random() < 0.4 for _ in range(width)]
+        if not any(question):
+            question[rng.randrange(width)] = True
+        correct.append(question)
+    quiz = make_quiz(correct)
+    answer_sets = [random_answers(rng, correct) for _ in range(500)]
+    assert score_many(quiz, answer_sets) == [score_one(quiz, answers) for answers in answer_sets]
@@ -0,0 +1,31 @@
+"""
+Validation of Questions and Quizzes shared by the API endpoints and bulk import.
+Failures raise HTTPException with the status code and detail returned to the client.
+"""
+from fastapi import HTTPException, status
+
+from models import Question, Quiz
+
+
+QUESTION_ANSWERS_MAX = 5
+QUIZ_QUESTIONS_MAX = 10
+
+
+def validate_question(question: Question, new: bool = False):
+    """Check Question answers, and that new Questions have text."""
+    if new and not question.text:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Question text is required")
+    if not (len(question.answers) <= QUESTION_ANSWERS_MAX or len(question.correct) <= QUESTION_ANSWERS_MAX):
+        detail = "Question cannot have more than {} answers".format(QUESTION_ANSWERS_MAX)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=detail)
+    if question.correct and not any(question.correct):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Question must have a correct answer")
+
+
+def validate_quiz(quiz: Quiz, new: bool = False):
+    """Check number of Quiz questions, and that new Quizzes have a title."""
+    if new and not quiz.title:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Quiz title is required")
+    if len(quiz.questions) > QUIZ_QUESTIONS_MAX:
+        detail = "Quiz cannot have more than {} questions".format(QUIZ_QUESTIONS_MAX)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=detail)